@@ -7,6 +7,8 @@ from datetime import datetime
 # Import des fonctions et constantes depuis utils.py
 # (Assurez-vous que utils.py est dans le même répertoire)
 import utils
+import drafts
+import report_template
 
 # --- CONFIGURATION ET STYLE ---
 st.set_page_config(page_title="Formulaire Dynamique - Firestore", layout="centered")
@@ -35,6 +37,7 @@ def init_session_state():
     defaults = {
         'step': 'PROJECT_LOAD',
         'project_data': None,
+        'photo_profile': None,
         'collected_data': [],
         'current_phase_temp': {},
         'current_phase_name': None,
@@ -45,8 +48,8 @@ def init_session_state():
         'form_start_time': None,
         'submission_id': None,
         'show_comment_on_error': False,
-        'df_struct': None,
-        'df_site': None,
+        'ref_version': None,
+        'draft': None,
         'last_validation_errors': None 
     }
     for key, value in defaults.items():
@@ -55,6 +58,37 @@ def init_session_state():
 
 init_session_state()
 
+def get_reference_data():
+    """Instantané partagé (structure + Sites) sur lequel la session est épinglée."""
+    return utils.get_reference_store().get(st.session_state['ref_version'])
+
+def resume_draft(submission_id, df_site):
+    """Restaure un audit interrompu depuis son brouillon ; retourne False si le projet est introuvable."""
+    state = utils.get_draft_writer().resume(submission_id)
+    rows = df_site[df_site['Intitulé'] == state['project_intitule']]
+    if rows.empty: return False
+    st.session_state['project_data'] = utils.load_project_data(rows.iloc[0])
+    st.session_state['photo_profile'] = utils.build_photo_profile(st.session_state['project_data'])
+    st.session_state['form_start_time'] = state['start_time'] or datetime.now()
+    st.session_state['submission_id'] = submission_id
+    st.session_state['collected_data'] = state['collected_data']
+    st.session_state['current_phase_temp'] = state['current_phase_temp']
+    st.session_state['identification_completed'] = bool(state['collected_data'])
+    st.session_state['iteration_id'] = str(uuid.uuid4())
+    st.session_state['show_comment_on_error'] = False
+    st.session_state['last_validation_errors'] = None
+    if not state['collected_data']:
+        st.session_state['step'] = 'IDENTIFICATION'
+    elif state['current_phase_name']:
+        st.session_state['step'] = 'FILL_PHASE'
+        st.session_state['current_phase_name'] = state['current_phase_name']
+    else:
+        st.session_state['step'] = 'LOOP_DECISION'
+    draft = drafts.DraftSession(submission_id)
+    draft.prime(state['current_phase_name'], state['current_phase_temp'], state['last_seq'])
+    st.session_state['draft'] = draft
+    return True
+
 # --- FLUX PRINCIPAL ---
 
 st.markdown('<div class="main-header"><h1>📝Formulaire Chantier </h1></div>', unsafe_allow_html=True)
@@ -63,31 +97,45 @@ st.markdown('<div class="main-header"><h1>📝Formulaire Chantier </h1></div>',
 if st.session_state['step'] == 'PROJECT_LOAD':
     st.info("Tentative de chargement de la structure des formulaires...")
     with st.spinner("Chargement en cours..."):
-        df_struct = utils.load_form_structure_from_firestore()
-        utils.load_site_data_from_firestore.clear() 
-        df_site = utils.load_site_data_from_firestore()
+        snapshot = utils.get_reference_store().current()
         
-        if df_struct is not None and df_site is not None:
-            st.session_state['df_struct'] = df_struct
-            st.session_state['df_site'] = df_site
+        if snapshot is not None:
+            st.session_state['ref_version'] = snapshot.version
             st.session_state['step'] = 'PROJECT'
             st.rerun()
         else:
             st.error("Impossible de charger les données. Vérifiez votre connexion et les secrets Firebase.")
             if st.button("Réessayer le chargement"):
-                utils.load_form_structure_from_firestore.clear() 
-                utils.load_site_data_from_firestore.clear() 
+                utils.get_reference_store().current(force_refresh=True)
                 st.session_state['step'] = 'PROJECT_LOAD'
                 st.rerun()
 
 # 2. SELECTION PROJET
 elif st.session_state['step'] == 'PROJECT':
-    df_site = st.session_state['df_site']
+    # Audit pas encore démarré : on se place sur la dernière version des données de référence
+    latest = utils.get_reference_store().current()
+    if latest is not None: st.session_state['ref_version'] = latest.version
+    df_site = get_reference_data().df_site
     st.markdown("### 🏗️ Sélection du Chantier")
     
     if 'Intitulé' not in df_site.columns:
         st.error("Colonne 'Intitulé' manquante dans les données 'Sites'.")
     else:
+        with st.expander("♻️ Reprendre un audit interrompu", expanded=False):
+            open_drafts = {d['submission_id']: d for d in utils.list_open_drafts()}
+            if not open_drafts:
+                st.caption("Aucun audit en cours à reprendre.")
+            else:
+                draft_id = st.selectbox(
+                    "Audits en cours", [""] + list(open_drafts),
+                    format_func=lambda k: f"{open_drafts[k].get('project_intitule', '?')} — {open_drafts[k].get('updated_at', '')}" if k else ""
+                )
+                if draft_id and st.button("▶️ Reprendre cet audit"):
+                    if resume_draft(draft_id, df_site):
+                        st.rerun()
+                    else:
+                        st.error("Projet du brouillon introuvable dans les données 'Sites'.")
+
         search_term = st.text_input("Rechercher un projet (Veuillez renseigner au minimum 3 caractères pour le nom de la ville)", key="project_search_input").strip()
         filtered_projects = []
         selected_proj = None
@@ -107,7 +155,8 @@ elif st.session_state['step'] == 'PROJECT':
             row = df_site[df_site['Intitulé'] == selected_proj].iloc[0]
             st.info(f"Projet sélectionné : **{selected_proj}**")
             if st.button("✅ Démarrer l'identification"):
-                st.session_state['project_data'] = row.to_dict()
+                st.session_state['project_data'] = utils.load_project_data(row)
+                st.session_state['photo_profile'] = utils.build_photo_profile(st.session_state['project_data'])
                 st.session_state['form_start_time'] = datetime.now() 
                 st.session_state['submission_id'] = str(uuid.uuid4())
                 st.session_state['step'] = 'IDENTIFICATION'
@@ -115,29 +164,30 @@ elif st.session_state['step'] == 'PROJECT':
                 st.session_state['iteration_id'] = str(uuid.uuid4())
                 st.session_state['show_comment_on_error'] = False
                 st.session_state['last_validation_errors'] = None
+                st.session_state['draft'] = drafts.DraftSession(st.session_state['submission_id'])
+                utils.checkpoint_draft(st.session_state['draft'], st.session_state['draft'].start(selected_proj, st.session_state['form_start_time']))
                 st.rerun()
 
 # 3. IDENTIFICATION
 elif st.session_state['step'] == 'IDENTIFICATION':
-    df = st.session_state['df_struct']
-    ID_SECTION_NAME = df['section'].iloc[0]
+    ref = get_reference_data()
+    df = ref.df_struct
+    ID_SECTION_NAME = ref.sections[0]
     st.markdown(f"### 👤 Étape unique : {ID_SECTION_NAME}")
     
-    identification_questions = df[df['section'] == ID_SECTION_NAME].copy()
-    
-    # 1. Assurer que l'ID est numérique
-    identification_questions['id_temp'] = pd.to_numeric(identification_questions['id'], errors='coerce').fillna(0)
-    
-    # 2. Trier par ID numérique croissant pour la logique conditionnelle
-    identification_questions = identification_questions.sort_values(by='id_temp')
+    # Trier par ID (déjà numérique) croissant pour la logique conditionnelle
+    identification_questions = df[df['section'] == ID_SECTION_NAME].sort_values(by='id')
 
     if st.session_state['id_rendering_ident'] is None: st.session_state['id_rendering_ident'] = str(uuid.uuid4())
     rendering_id = st.session_state['id_rendering_ident']
     
     for idx, (index, row) in enumerate(identification_questions.iterrows()):
         if utils.check_condition(row, st.session_state['current_phase_temp'], st.session_state['collected_data']):
-            utils.render_question(row, st.session_state['current_phase_temp'], ID_SECTION_NAME, rendering_id, idx, st.session_state['project_data'])
-            
+            utils.render_question(row, st.session_state['current_phase_temp'], ID_SECTION_NAME, rendering_id, idx, st.session_state['photo_profile'])
+    
+    # Point de sauvegarde incrémental (seules les réponses modifiées sont écrites)
+    if st.session_state['draft'] is not None:
+        utils.checkpoint_draft(st.session_state['draft'], st.session_state['draft'].diff(ID_SECTION_NAME, st.session_state['current_phase_temp']))
 
     # --- AFFICHAGE PERSISTANT DES ERREURS DE VALIDATION (IDENTIFICATION) ---
     if st.session_state['last_validation_errors']:
@@ -152,16 +202,18 @@ elif st.session_state['step'] == 'IDENTIFICATION':
         st.session_state['last_validation_errors'] = None # Réinitialisation à la tentative de validation
         
         # --- CORRECTION ROBUSTESSE IDENTIFICATION (Vérification df_struct) ---
-        df_struct = st.session_state.get('df_struct')
+        df_struct = df
         if df_struct is None:
             st.error("Structure du formulaire manquante. Veuillez recharger le projet.")
             st.rerun() # <--- CORRECTION ICI
         # --------------------------------------------------------------------
         
         # NOTE: On n'utilise pas le try/except ici pour ne pas masquer d'erreur dans l'étape initiale
-        is_valid, errors = utils.validate_section(df_struct, ID_SECTION_NAME, st.session_state['current_phase_temp'], st.session_state['collected_data'], st.session_state['project_data'])
+        is_valid, errors = utils.validate_section(df_struct, ID_SECTION_NAME, st.session_state['current_phase_temp'], st.session_state['collected_data'], st.session_state['photo_profile'])
         
         if is_valid:
+            if st.session_state['draft'] is not None:
+                utils.checkpoint_draft(st.session_state['draft'], st.session_state['draft'].validate(ID_SECTION_NAME, st.session_state['current_phase_temp']))
             id_entry = {"phase_name": ID_SECTION_NAME, "answers": st.session_state['current_phase_temp'].copy()}
             st.session_state['collected_data'].append(id_entry)
             st.session_state['identification_completed'] = True
@@ -238,12 +290,13 @@ elif st.session_state['step'] in ['LOOP_DECISION', 'FILL_PHASE']:
         st.markdown('</div>', unsafe_allow_html=True)
 
     elif st.session_state['step'] == 'FILL_PHASE':
-        df = st.session_state['df_struct']
-        ID_SECTION_NAME = df['section'].iloc[0]
+        ref = get_reference_data()
+        df = ref.df_struct
+        ID_SECTION_NAME = ref.sections[0]
         ID_SECTION_CLEAN = str(ID_SECTION_NAME).strip().lower()
         # Exclure la section d'identification et la ligne de question 'phase' si elle existe
         SECTIONS_TO_EXCLUDE_CLEAN = {ID_SECTION_CLEAN, "phase"} 
-        all_sections_raw = df['section'].unique().tolist()
+        all_sections_raw = ref.sections
         available_phases = []
         for sec in all_sections_raw:
             if pd.isna(sec) or not sec or str(sec).strip().lower() in SECTIONS_TO_EXCLUDE_CLEAN: continue
@@ -267,6 +320,8 @@ elif st.session_state['step'] in ['LOOP_DECISION', 'FILL_PHASE']:
             current_phase = st.session_state['current_phase_name']
             st.markdown(f"### 📝 {current_phase}")
             if st.button("🔄 Changer de phase"):
+                if st.session_state['draft'] is not None:
+                    utils.checkpoint_draft(st.session_state['draft'], st.session_state['draft'].discard())
                 st.session_state['current_phase_name'] = None
                 st.session_state['current_phase_temp'] = {}
                 st.session_state['iteration_id'] = str(uuid.uuid4())
@@ -275,16 +330,14 @@ elif st.session_state['step'] in ['LOOP_DECISION', 'FILL_PHASE']:
                 st.rerun()
             st.divider()
             
-            section_questions = df[df['section'] == current_phase].copy()
-            section_questions['id_temp'] = pd.to_numeric(section_questions['id'], errors='coerce').fillna(0)
-            section_questions = section_questions.sort_values(by='id_temp')
+            section_questions = df[df['section'] == current_phase].sort_values(by='id')
 
             visible_count = 0
             for idx, (index, row) in enumerate(section_questions.iterrows()):
-                if int(row.get('id', 0)) == utils.COMMENT_ID: continue
+                if row['id'] == utils.COMMENT_ID: continue
                 
                 if utils.check_condition(row, st.session_state['current_phase_temp'], st.session_state['collected_data']):
-                    utils.render_question(row, st.session_state['current_phase_temp'], current_phase, st.session_state['iteration_id'], idx, st.session_state['project_data'])
+                    utils.render_question(row, st.session_state['current_phase_temp'], current_phase, st.session_state['iteration_id'], idx, st.session_state['photo_profile'])
                     visible_count += 1
             
             if visible_count == 0 and not st.session_state.get('show_comment_on_error', False):
@@ -294,7 +347,11 @@ elif st.session_state['step'] in ['LOOP_DECISION', 'FILL_PHASE']:
                 st.markdown("---")
                 st.markdown("### ✍️ Justification de l'Écart")
                 comment_row = pd.Series({'id': utils.COMMENT_ID, 'type': 'text'}) 
-                utils.render_question(comment_row, st.session_state['current_phase_temp'], current_phase, st.session_state['iteration_id'], 999, st.session_state['project_data']) 
+                utils.render_question(comment_row, st.session_state['current_phase_temp'], current_phase, st.session_state['iteration_id'], 999, st.session_state['photo_profile']) 
+            
+            # Point de sauvegarde incrémental (seules les réponses modifiées sont écrites)
+            if st.session_state['draft'] is not None:
+                utils.checkpoint_draft(st.session_state['draft'], st.session_state['draft'].diff(current_phase, st.session_state['current_phase_temp']))
             
             # --- AFFICHAGE PERSISTANT DES ERREURS DE VALIDATION (PHASE) ---
             if st.session_state['last_validation_errors']:
@@ -308,6 +365,8 @@ elif st.session_state['step'] in ['LOOP_DECISION', 'FILL_PHASE']:
             c1, c2 = st.columns([1, 2])
             with c1:
                 if st.button("❌ Annuler"):
+                    if st.session_state['draft'] is not None:
+                        utils.checkpoint_draft(st.session_state['draft'], st.session_state['draft'].discard())
                     st.session_state['step'] = 'LOOP_DECISION'
                     st.session_state['current_phase_temp'] = {}
                     st.session_state['show_comment_on_error'] = False
@@ -319,7 +378,7 @@ elif st.session_state['step'] in ['LOOP_DECISION', 'FILL_PHASE']:
                     st.session_state['last_validation_errors'] = None
 
                     # --- CORRECTION ROBUSTESSE PHASE (Vérification df_struct) ---
-                    df_struct = st.session_state.get('df_struct')
+                    df_struct = df
                     if df_struct is None:
                         st.error("Structure du formulaire manquante. Veuillez recharger le projet.")
                         st.rerun() # <--- CORRECTION ICI
@@ -333,7 +392,7 @@ elif st.session_state['step'] in ['LOOP_DECISION', 'FILL_PHASE']:
                             current_phase, 
                             st.session_state['current_phase_temp'], 
                             st.session_state['collected_data'], 
-                            st.session_state['project_data']
+                            st.session_state['photo_profile']
                         )
                     except AttributeError as e:
                         # Si l'erreur se produit DANS la fonction de validation
@@ -344,6 +403,8 @@ elif st.session_state['step'] in ['LOOP_DECISION', 'FILL_PHASE']:
                         st.stop()
 
                     if is_valid:
+                        if st.session_state['draft'] is not None:
+                            utils.checkpoint_draft(st.session_state['draft'], st.session_state['draft'].validate(current_phase, st.session_state['current_phase_temp']))
                         new_entry = {"phase_name": current_phase, "answers": st.session_state['current_phase_temp'].copy()}
                         st.session_state['collected_data'].append(new_entry)
                         st.success("Phase validée et enregistrée !")
@@ -384,6 +445,8 @@ elif st.session_state['step'] == 'FINISHED':
 
             if success:
                 st.session_state['data_saved'] = True
+                if st.session_state['draft'] is not None:
+                    utils.checkpoint_draft(st.session_state['draft'], st.session_state['draft'].completed())
                 st.session_state['submission_id_final'] = result_message
             else:
                 st.error(f"Erreur lors de la sauvegarde : {result_message}")
@@ -393,13 +456,15 @@ elif st.session_state['step'] == 'FINISHED':
         st.info(f"Les données sont sauvegardées dans Firestore (ID: {st.session_state.get('submission_id_final', 'N/A')})")
 
     if st.session_state['data_saved']:
+        ref = get_reference_data()
         # Préparation des exports
         csv_data = utils.create_csv_export(
             st.session_state['collected_data'], 
-            st.session_state['df_struct'], 
+            ref.df_struct, 
             project_name, 
             st.session_state['submission_id'], 
-            st.session_state['form_start_time']
+            st.session_state['form_start_time'],
+            question_index=ref.question_index
         )
         zip_buffer = utils.create_zip_export(st.session_state['collected_data'])
         date_str = datetime.now().strftime('%Y%m%d_%H%M')
@@ -407,7 +472,7 @@ elif st.session_state['step'] == 'FINISHED':
         # --- 2. TÉLÉCHARGEMENT DIRECT ---
         st.markdown("### 📥 Télécharger les fichiers")
         
-        col_csv, col_zip, col_word = st.columns(3)
+        col_csv, col_zip, col_word, col_html = st.columns(4)
         
         file_name_csv = f"Export_{project_name}_{date_str}.csv"
         with col_csv:
@@ -435,9 +500,11 @@ elif st.session_state['step'] == 'FINISHED':
             try:
                 word_buffer = utils.create_word_report(
                     st.session_state['collected_data'],
-                    st.session_state['df_struct'],
+                    ref.df_struct,
                     st.session_state['project_data'],
-                    st.session_state['form_start_time']
+                    st.session_state['form_start_time'],
+                    question_index=ref.question_index,
+                    template_version=st.secrets.get('report_template_version', report_template.REPORT_TEMPLATE_VERSION)
                 )
                 
                 file_name_word = f"Rapport_{project_name}_{date_str}.docx"
@@ -451,6 +518,28 @@ elif st.session_state['step'] == 'FINISHED':
                     )
             except Exception as e:
                 st.error(f"Erreur lors de la génération du rapport Word : {e}")
+        
+        # Rapport HTML léger (consultation sur mobile)
+        try:
+            file_name_html = f"Rapport_{project_name}_{date_str}.html"
+            html_buffer = utils.create_html_report(
+                st.session_state['collected_data'],
+                ref.df_struct,
+                st.session_state['project_data'],
+                st.session_state['form_start_time'],
+                zip_file_name=f"Photos_{project_name}_{date_str}.zip",
+                question_index=ref.question_index
+            )
+            with col_html:
+                st.download_button(
+                    label="🌐 Rapport HTML", 
+                    data=html_buffer.getvalue(), 
+                    file_name=file_name_html, 
+                    mime='text/html',
+                    use_container_width=True
+                )
+        except Exception as e:
+            st.error(f"Erreur lors de la génération du rapport HTML : {e}")
     
         # --- 3. OUVERTURE DE L'APPLICATION NATIVE (MAILTO) ---
         st.markdown("---")
@@ -464,7 +553,8 @@ elif st.session_state['step'] == 'FINISHED':
             f"Fichiers à joindre :\n"
             f"- {file_name_csv}\n"
             f"- {file_name_zip}\n"
-            f"- {file_name_word}\n\n"
+            f"- {file_name_word}\n"
+            f"- {file_name_html}\n\n"
             f"Cordialement."
         )
         
@@ -485,5 +575,8 @@ elif st.session_state['step'] == 'FINISHED':
 
     st.markdown("---")
     if st.button("🔄 Recommencer l'audit"):
+        if st.session_state['draft'] is not None and not st.session_state['data_saved']:
+            # Audit non enregistré puis abandonné : il ne doit plus être proposé à la reprise
+            utils.checkpoint_draft(st.session_state['draft'], st.session_state['draft'].abandoned())
         st.session_state.clear()
         st.rerun()
@@ -0,0 +1 @@
+# Modèles Word du rapport d'audit (voir report_template.py)
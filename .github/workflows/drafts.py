@@ -0,0 +1,374 @@
+# drafts.py (Brouillons incrémentaux : reprise d'un audit après une perte de session)
+import hashlib
+import json
+import logging
+import re
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from io import BytesIO
+from pathlib import Path
+
+# --- CONSTANTES ---
+DRAFTS_COLLECTION = 'FormDrafts'
+LOCAL_DRAFT_DIR = Path(__file__).resolve().parent / '.drafts'
+FIRESTORE_BLOB_CHUNK = 900 * 1024  # Un document Firestore est limité à 1 Mio
+FIRESTORE_BLOB_CHUNKS_PER_BATCH = 8  # Une requête Firestore est limitée à 10 Mio
+DRAFT_WRITER_WORKERS = 4
+DRAFT_EXPIRY_DAYS = 7  # Un brouillon sans activité depuis ce délai n'est plus proposé à la reprise
+
+STATUS_OPEN = 'open'
+STATUS_COMPLETED = 'completed'
+STATUS_ABANDONED = 'abandoned'
+
+logger = logging.getLogger(__name__)
+
+# --- PHOTOS RESTAURÉES ---
+class UploadedPhoto(BytesIO):
+    """Photo restaurée depuis un brouillon ; se comporte comme un fichier téléversé Streamlit (.name, .read, .getvalue)."""
+
+    def __init__(self, data, name, file_id=None):
+        super().__init__(data)
+        self.name = name
+        self.file_id = file_id
+
+def is_file_list(value):
+    return isinstance(value, list) and bool(value) and all(hasattr(f, 'read') for f in value)
+
+# --- SUIVI CÔTÉ SESSION ---
+class DraftSession:
+    """Mémorise ce qui a déjà été envoyé au brouillon d'une soumission, pour n'écrire que les différences.
+
+    Les événements produits (journal en ajout seul) :
+      start     : projet et date de début
+      reset     : nouvelle phase en cours (réponses courantes vidées)
+      set / del : réponse ajoutée, modifiée ou supprimée dans la phase en cours
+      validate  : la phase en cours est validée et rejoint les phases collectées
+      completed : audit enregistré dans FormAnswers
+      abandoned : audit abandonné par l'auditeur (il n'est plus proposé à la reprise)
+
+    Chaque événement reçoit un numéro de séquence ('seq') propre à la soumission : la relecture suit cet
+    ordre, indépendamment des horloges et du réplica qui a écrit.
+    """
+
+    def __init__(self, submission_id):
+        self.submission_id = submission_id
+        self.seq = 0
+        self.phase_name = None
+        self.sent = {}
+        self.photo_hashes = {}
+        self.blobs_sent = set()
+
+    def _encode(self, value, blobs):
+        if hasattr(value, 'read'):
+            value = [value]
+        if is_file_list(value):
+            refs = []
+            for f in value:
+                file_key = getattr(f, 'file_id', None)
+                sha = self.photo_hashes.get(file_key) if file_key else None
+                if sha is None:
+                    data = f.getvalue()
+                    sha = hashlib.sha256(data).hexdigest()[:32]
+                    if file_key: self.photo_hashes[file_key] = sha
+                    if sha not in self.blobs_sent: blobs[sha] = data
+                refs.append({'name': getattr(f, 'name', ''), 'sha': sha})
+            return {'photos': refs}
+        if hasattr(value, 'item'):  # Scalaires numpy
+            value = value.item()
+        if value is None or isinstance(value, (str, int, float, bool, list)):
+            return value
+        return str(value)
+
+    def _numbered(self, events):
+        for event in events:
+            self.seq += 1
+            event['seq'] = self.seq
+        return events
+
+    def start(self, project_intitule, start_time):
+        event = {'op': 'start', 'project': project_intitule, 'start_time': start_time.isoformat() if start_time else None}
+        meta = {'project_intitule': project_intitule, 'status': STATUS_OPEN}
+        return self._numbered([event]), {}, meta
+
+    def diff(self, phase_name, answers):
+        """Événements set/del décrivant l'écart entre les réponses courantes et le dernier envoi."""
+        events, blobs = [], {}
+        if phase_name != self.phase_name:
+            events.append({'op': 'reset', 'phase': phase_name})
+            self.phase_name, self.sent = phase_name, {}
+        current = {str(q_id): self._encode(value, blobs) for q_id, value in answers.items()}
+        for key, encoded in current.items():
+            if key not in self.sent or self.sent[key] != encoded:
+                events.append({'op': 'set', 'q': key, 'v': encoded})
+        for key in self.sent.keys() - current.keys():
+            events.append({'op': 'del', 'q': key})
+        self.sent = current
+        self.blobs_sent.update(blobs)
+        return self._numbered(events), blobs, None
+
+    def validate(self, phase_name, answers):
+        events, blobs, _ = self.diff(phase_name, answers)
+        events.append(self._numbered([{'op': 'validate', 'phase': phase_name}])[0])
+        self.phase_name, self.sent = None, {}
+        return events, blobs, None
+
+    def discard(self):
+        """La phase en cours est abandonnée (annulation ou changement de phase)."""
+        self.phase_name, self.sent = None, {}
+        return self._numbered([{'op': 'reset', 'phase': None}]), {}, None
+
+    def completed(self):
+        return self._numbered([{'op': 'completed'}]), {}, {'status': STATUS_COMPLETED}
+
+    def abandoned(self):
+        return self._numbered([{'op': 'abandoned'}]), {}, {'status': STATUS_ABANDONED}
+
+    def prime(self, phase_name, answers, last_seq=0):
+        """Aligne le suivi sur un état restauré (dont le dernier numéro de séquence), sans rien réécrire."""
+        self.diff(phase_name, answers)
+        self.seq = last_seq
+
+# --- RELECTURE ---
+def replay(events, get_blob):
+    """Reconstruit l'état d'un audit à partir de son journal d'événements, dans l'ordre des numéros de séquence.
+
+    Un événement écrit deux fois (lot renvoyé après un échec d'écriture partiel) n'est appliqué qu'une fois.
+    """
+    state = {
+        'project_intitule': None, 'start_time': None, 'collected_data': [],
+        'current_phase_name': None, 'current_phase_temp': {}, 'completed': False, 'last_seq': 0,
+    }
+    blob_cache = {}
+    unnumbered, numbered = [], {}
+    for event in events:
+        if isinstance(event.get('seq'), int):
+            numbered.setdefault(event['seq'], event)
+        else:
+            unnumbered.append(event)
+    events = unnumbered + [numbered[seq] for seq in sorted(numbered)]
+
+    def decode(value):
+        if isinstance(value, dict) and 'photos' in value:
+            photos = []
+            for ref in value['photos']:
+                if ref['sha'] not in blob_cache: blob_cache[ref['sha']] = get_blob(ref['sha'])
+                data = blob_cache[ref['sha']]
+                if data is not None: photos.append(UploadedPhoto(data, ref['name'], file_id=ref['sha']))
+            return photos
+        return value
+
+    for event in events:
+        if isinstance(event.get('seq'), int): state['last_seq'] = max(state['last_seq'], event['seq'])
+        op = event.get('op')
+        if op == 'start':
+            state['project_intitule'] = event.get('project')
+            state['start_time'] = datetime.fromisoformat(event['start_time']) if event.get('start_time') else None
+        elif op == 'reset':
+            state['current_phase_name'], state['current_phase_temp'] = event.get('phase'), {}
+        elif op == 'set':
+            state['current_phase_temp'][int(event['q'])] = decode(event['v'])
+        elif op == 'del':
+            state['current_phase_temp'].pop(int(event['q']), None)
+        elif op == 'validate':
+            state['collected_data'].append({'phase_name': event['phase'], 'answers': state['current_phase_temp']})
+            state['current_phase_name'], state['current_phase_temp'] = None, {}
+        elif op == 'completed':
+            state['completed'] = True
+    return state
+
+# --- STOCKAGES ---
+def draft_expiry_cutoff(days=DRAFT_EXPIRY_DAYS):
+    """Date (ISO, comparable à 'updated_at') en deçà de laquelle un brouillon ouvert est considéré comme expiré."""
+    return (datetime.now() - timedelta(days=days)).isoformat(timespec='seconds')
+
+def check_submission_id(submission_id):
+    if not re.fullmatch(r'[\w-]+', str(submission_id)):
+        raise ValueError(f"Identifiant de soumission invalide : {submission_id!r}")
+    return str(submission_id)
+
+class LocalDraftStore:
+    """Brouillons sur disque : un journal JSONL par soumission, photos stockées une seule fois par empreinte."""
+
+    def __init__(self, root=LOCAL_DRAFT_DIR):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+
+    def _journal(self, submission_id):
+        return self.root / f"{check_submission_id(submission_id)}.jsonl"
+
+    def _meta(self, submission_id):
+        return self.root / f"{check_submission_id(submission_id)}.meta.json"
+
+    def _write_atomic(self, path, data):
+        tmp = path.with_name(path.name + '.tmp')
+        tmp.write_bytes(data)
+        tmp.replace(path)
+
+    def append(self, submission_id, events, meta=None):
+        with self._lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            with open(self._journal(submission_id), 'a', encoding='utf-8') as f:
+                for event in events:
+                    f.write(json.dumps(event, ensure_ascii=False) + '\n')
+            if meta:
+                meta_path = self._meta(submission_id)
+                current = json.loads(meta_path.read_text(encoding='utf-8')) if meta_path.exists() else {'submission_id': submission_id}
+                current.update(meta)
+                self._write_atomic(meta_path, json.dumps(current, ensure_ascii=False).encode('utf-8'))
+
+    def put_blob(self, submission_id, sha, data):
+        path = self.root / check_submission_id(submission_id) / sha
+        if path.exists(): return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._write_atomic(path, data)
+
+    def get_blob(self, submission_id, sha):
+        path = self.root / check_submission_id(submission_id) / sha
+        return path.read_bytes() if path.exists() else None
+
+    def load(self, submission_id):
+        path = self._journal(submission_id)
+        if not path.exists(): return []
+        events = []
+        for line in path.read_text(encoding='utf-8').splitlines():
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                break  # Dernière ligne tronquée par un arrêt brutal
+        return events
+
+    def list_drafts(self, limit=20):
+        cutoff = draft_expiry_cutoff()
+        drafts = []
+        for meta_path in self.root.glob('*.meta.json'):
+            try:
+                meta = json.loads(meta_path.read_text(encoding='utf-8'))
+            except ValueError:
+                continue
+            if meta.get('status') == STATUS_OPEN and meta.get('updated_at', '') >= cutoff: drafts.append(meta)
+        drafts.sort(key=lambda m: m.get('updated_at', ''), reverse=True)
+        return drafts[:limit]
+
+class FirestoreDraftStore:
+    """Brouillons Firestore : FormDrafts/{id} (métadonnées), sous-collections 'events' et 'blobs'."""
+
+    def __init__(self, db, collection=DRAFTS_COLLECTION):
+        self.db = db
+        self.collection = collection
+
+    def _doc(self, submission_id):
+        return self.db.collection(self.collection).document(check_submission_id(submission_id))
+
+    def append(self, submission_id, events, meta=None):
+        doc = self._doc(submission_id)
+        batch = self.db.batch()
+        # Identifiant = premier numéro de séquence du lot : un lot renvoyé réécrit le même document
+        batch.set(doc.collection('events').document(f"{events[0]['seq']:012d}"), {'events': events})
+        if meta:
+            batch.set(doc, {'submission_id': submission_id, **meta}, merge=True)
+        batch.commit()
+
+    def put_blob(self, submission_id, sha, data):
+        blobs = self._doc(submission_id).collection('blobs')
+        chunks = [data[i:i + FIRESTORE_BLOB_CHUNK] for i in range(0, len(data), FIRESTORE_BLOB_CHUNK)] or [b'']
+        # Lots écrits du dernier au premier : le morceau 000, lu en premier par get_blob, n'existe qu'une fois la photo complète
+        starts = list(range(0, len(chunks), FIRESTORE_BLOB_CHUNKS_PER_BATCH))
+        for start in reversed(starts):
+            batch = self.db.batch()
+            for idx in range(start, min(start + FIRESTORE_BLOB_CHUNKS_PER_BATCH, len(chunks))):
+                batch.set(blobs.document(f"{sha}_{idx:03d}"), {'data': chunks[idx], 'chunks': len(chunks)})
+            batch.commit()
+
+    def get_blob(self, submission_id, sha):
+        blobs = self._doc(submission_id).collection('blobs')
+        first = blobs.document(f"{sha}_000").get()
+        if not first.exists: return None
+        first = first.to_dict()
+        parts = [first['data']]
+        for idx in range(1, first.get('chunks', 1)):
+            parts.append(blobs.document(f"{sha}_{idx:03d}").get().to_dict()['data'])
+        return b''.join(parts)
+
+    def load(self, submission_id):
+        events = []
+        for doc in self._doc(submission_id).collection('events').order_by('__name__').stream():
+            events.extend(doc.to_dict().get('events', []))
+        return events
+
+    def list_drafts(self, limit=20):
+        """Les `limit` brouillons ouverts les plus récents, non expirés : au plus `limit` lectures.
+
+        Requiert l'index composite FormDrafts (status ASC, updated_at DESC).
+        """
+        query = (
+            self.db.collection(self.collection)
+            .where('status', '==', STATUS_OPEN)
+            .where('updated_at', '>=', draft_expiry_cutoff())
+            .order_by('updated_at', direction='DESCENDING')
+            .limit(limit)
+        )
+        return [doc.to_dict() for doc in query.stream()]
+
+# --- ÉCRITURE EN ARRIÈRE-PLAN ---
+class DraftWriter:
+    """Écrit les brouillons en arrière-plan : l'interface n'attend jamais.
+
+    Une file par soumission, vidée par un seul thread à la fois : l'ordre est conservé pour chaque audit,
+    tandis que les audits de plusieurs sessions s'écrivent en parallèle sur un petit pool.
+    DraftSession considère chaque point de sauvegarde comme envoyé ; un point dont l'écriture échoue est donc
+    conservé ici et renvoyé, avant les suivants, au prochain point de la même soumission.
+    """
+
+    def __init__(self, store, workers=DRAFT_WRITER_WORKERS):
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='draft-writer')
+        self._lock = threading.Lock()
+        self._queues = {}  # submission_id -> file des points à écrire ; présente tant qu'un thread la vide
+        self._failed = {}  # submission_id -> (événements, photos, métadonnées) ; manipulé par le thread de la file uniquement
+
+    def submit(self, submission_id, checkpoint):
+        """Met le point en file ; le Future renvoyé vaut True une fois écrit, False si l'écriture a échoué."""
+        events, blobs, meta = checkpoint
+        if not events: return None
+        stamp = datetime.now().isoformat(timespec='seconds')
+        for event in events: event['ts'] = stamp
+        meta = {**(meta or {}), 'updated_at': stamp}
+        future = Future()
+        with self._lock:
+            pending = self._queues.get(submission_id)
+            start = pending is None
+            if start: pending = self._queues[submission_id] = deque()
+            pending.append((events, blobs, meta, future))
+        if start:
+            self._executor.submit(self._drain, submission_id)
+        return future
+
+    def _drain(self, submission_id):
+        while True:
+            with self._lock:
+                pending = self._queues[submission_id]
+                if not pending:
+                    del self._queues[submission_id]
+                    return
+                events, blobs, meta, future = pending.popleft()
+            future.set_result(self._write(submission_id, events, blobs, meta))
+
+    def _write(self, submission_id, events, blobs, meta):
+        failed = self._failed.pop(submission_id, None)
+        if failed:
+            events, blobs, meta = failed[0] + events, {**failed[1], **blobs}, {**failed[2], **meta}
+        try:
+            for sha, data in blobs.items():
+                self.store.put_blob(submission_id, sha, data)
+            self.store.append(submission_id, events, meta)
+            return True
+        except Exception:
+            self._failed[submission_id] = (events, blobs, meta)
+            logger.exception("Échec d'écriture du brouillon %s (%d événements renvoyés au prochain point)", submission_id, len(events))
+            return False
+
+    def resume(self, submission_id):
+        """Relit le brouillon d'une soumission et reconstruit son état."""
+        return replay(self.store.load(submission_id), lambda sha: self.store.get_blob(submission_id, sha))
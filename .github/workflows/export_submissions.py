@@ -0,0 +1,34 @@
+# export_submissions.py (Export CSV de toutes les soumissions FormAnswers)
+#
+# Utilisation :
+#   python export_submissions.py soumissions.csv
+#   python export_submissions.py soumissions.csv.gz          (compressé gzip, déduit de l'extension)
+#
+# Les soumissions sont lues page par page et écrites au fil de l'eau : la mémoire reste constante quel que
+# soit le nombre de soumissions. Les identifiants Firebase sont ceux de l'application (secrets Streamlit).
+import argparse
+import sys
+import time
+
+import utils
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export CSV de toutes les soumissions FormAnswers.")
+    parser.add_argument('path', help="Fichier de sortie (.csv, ou .csv.gz pour un export compressé)")
+    parser.add_argument('--gzip', action='store_true', help="Force la compression gzip quelle que soit l'extension")
+    parser.add_argument('--page-size', type=int, default=utils.FIRESTORE_PAGE_SIZE, help="Soumissions lues par requête Firestore")
+    args = parser.parse_args(argv)
+
+    df_struct = utils.load_form_structure_from_firestore()
+    if df_struct is None:
+        print("Structure du formulaire indisponible : export annulé.", file=sys.stderr)
+        return 1
+    compress = args.gzip or args.path.endswith('.gz')
+    start = time.perf_counter()
+    with open(args.path, 'wb') as sink:
+        count = utils.export_submissions_csv(sink, df_struct, compress=compress, page_size=args.page_size)
+    print(f"{count} soumission(s) exportée(s) vers {args.path} en {time.perf_counter() - start:.1f} s")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
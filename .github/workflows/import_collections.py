@@ -0,0 +1,245 @@
+# import_collections.py (Import en masse d'un tableur vers 'formsquestions' ou 'Sites')
+#
+# Utilisation :
+#   python import_collections.py Sites sites.xlsx --dry-run
+#   python import_collections.py formsquestions questions.csv --workers 8
+#
+# Le fichier est comparé à la collection actuelle : seuls les documents nouveaux ou modifiés sont écrits,
+# par lots Firestore de taille maximale, plusieurs lots en parallèle. Les identifiants Firebase sont ceux
+# de l'application (secrets Streamlit). Les documents absents du fichier ne sont jamais supprimés.
+import argparse
+import math
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+import utils
+
+# --- CONSTANTES ---
+FIRESTORE_MAX_BATCH = 500  # Limite Firestore d'écritures par lot
+
+IMPORT_TARGETS = {
+    'formsquestions': {'key': 'id', 'rename': utils.FORM_COLUMN_RENAME_MAP, 'int_columns': ['id', 'Condition on']},
+    'Sites': {'key': utils.SITE_SEARCH_FIELD, 'rename': {}, 'int_columns': []},
+}
+
+# --- LECTURE ET NORMALISATION ---
+def read_table(path, sheet=None):
+    """Lit un CSV (séparateur détecté, BOM accepté) ou un classeur Excel (openpyxl requis), toutes cellules en texte.
+
+    Aucune inférence de type : '01234' reste '01234'. Les types sont repris de la collection (voir cast_like).
+    """
+    path = Path(path)
+    if path.suffix.lower() in ('.xlsx', '.xlsm', '.xls'):
+        return pd.read_excel(path, sheet_name=sheet or 0, dtype=str, keep_default_na=False)
+    return pd.read_csv(path, sep=None, engine='python', encoding='utf-8-sig', dtype=str, keep_default_na=False)
+
+def normalize_value(value):
+    """Valeur comparable : cellule vide -> None, texte nettoyé, flottant entier -> int."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if hasattr(value, 'item'):  # Scalaires numpy
+        value = value.item()
+    if isinstance(value, str):
+        return value.strip() or None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def parse_int(text):
+    """'12', '12.0' ou '12,0' -> 12 ; None si le texte n'est pas un entier."""
+    try:
+        number = float(str(text).replace(',', '.'))
+    except ValueError:
+        return None
+    return int(number) if number.is_integer() else None
+
+def normalize_key(value, target):
+    """Clé de rapprochement : entière pour les colonnes entières ('12', 12.0 et 12 désignent la même question)."""
+    value = normalize_value(value)
+    if value is not None and target['key'] in target['int_columns']:
+        number = parse_int(value)
+        return value if number is None else number
+    return value
+
+def normalize_records(df, target):
+    """Colonnes nettoyées et renommées comme dans load_form_structure_from_firestore ; une ligne par clé.
+
+    Les lignes sans clé (lignes vides en fin de classeur) sont ignorées ; les autres colonnes entières
+    vides valent 0, comme au chargement.
+    """
+    df = df.copy()
+    df.columns = df.columns.astype(str).str.strip()
+    df = df.rename(columns={k: v for k, v in target['rename'].items() if k in df.columns})
+    key = target['key']
+    if key not in df.columns:
+        raise ValueError(f"Colonne clé '{key}' absente du fichier (colonnes : {', '.join(df.columns)})")
+    records = {}
+    duplicates, invalid = set(), []
+    for row in df.to_dict('records'):
+        record = {col: normalize_value(value) for col, value in row.items()}
+        if record[key] is None: continue
+        key_value = normalize_key(record[key], target)
+        for col in target['int_columns']:
+            if col not in record: continue
+            number = parse_int(record[col]) if record[col] is not None else (None if col == key else 0)
+            if number is None:
+                invalid.append(f"{col}={record[col]!r}")
+            record[col] = number
+        if key_value in records: duplicates.add(key_value)
+        records[key_value] = record
+    if invalid:
+        raise ValueError(f"Valeurs entières invalides : {invalid[:20]}")
+    if duplicates:
+        raise ValueError(f"Clés en double dans le fichier : {sorted(map(str, duplicates))[:20]}")
+    return records
+
+# --- COMPARAISON ---
+def load_current_documents(collection, target):
+    """{clé: (id du document, données)} pour la collection actuelle, lue page par page."""
+    key = target['key']
+    current = {}
+    query = utils.db.collection(collection).order_by('__name__')
+    for docs in utils.iter_collection_pages(query, label=collection):
+        for doc in docs:
+            data = {str(k).strip(): v for k, v in (doc.to_dict() or {}).items()}
+            if data.get(key) is not None:
+                current[normalize_key(data[key], target)] = (doc.id, data)
+    return current
+
+def column_types(current):
+    """Type le plus fréquent de chaque champ dans la collection, pour typer les nouveaux documents."""
+    counts = {}
+    for _, data in current.values():
+        for col, value in data.items():
+            if value is None: continue
+            counts.setdefault(col, Counter())[type(value)] += 1
+    return {col: counter.most_common(1)[0][0] for col, counter in counts.items()}
+
+def cast_like(value, reference_type):
+    """Texte du fichier converti au type déjà utilisé en base ; inchangé si la conversion est impossible."""
+    if not isinstance(value, str) or reference_type in (None, str):
+        return value
+    if reference_type is bool:
+        lowered = value.lower()
+        if lowered in ('true', 'vrai', 'oui', '1'): return True
+        if lowered in ('false', 'faux', 'non', '0'): return False
+        return value
+    if reference_type in (int, float):
+        try:
+            number = float(value.replace(',', '.'))
+        except ValueError:
+            return value
+        return int(number) if reference_type is int and number.is_integer() else number
+    return value
+
+def stored_names(existing, rename):
+    """{nom normalisé: nom du champ dans le document} (ex. 'Condition value' -> 'Conditon value')."""
+    names = {col: col for col in existing}
+    for old, new in rename.items():
+        if old in existing and new not in existing: names[new] = old
+    return names
+
+def same_value(value, stored):
+    """Égalité au sens de l'import : une différence de type seule ('2' contre 2) n'est pas une modification."""
+    stored = normalize_value(stored)
+    if value == stored:
+        return True
+    return value is not None and stored is not None and str(value) == str(stored)
+
+def typed_record(record, existing, names, types):
+    """Record converti champ par champ au type du document existant, sinon au type dominant de la collection."""
+    typed = {}
+    for col, value in record.items():
+        stored = existing.get(names.get(col, col))
+        typed[col] = cast_like(value, type(stored) if stored is not None else types.get(col))
+    return typed
+
+def diff_collection(records, current, rename=None):
+    """Retourne (nouveaux, modifiés, inchangés, absents du fichier) ; modifiés = [(doc_id, champs à écrire, champs, clé)].
+
+    Les champs modifiés sont écrits sous le nom déjà utilisé par le document, pour ne pas créer de doublon.
+    """
+    types = column_types(current)
+    new, modified, unchanged = [], [], 0
+    for key_value, record in records.items():
+        if key_value not in current:
+            new.append(typed_record(record, {}, {}, types))
+            continue
+        doc_id, existing = current[key_value]
+        names = stored_names(existing, rename or {})
+        typed = typed_record(record, existing, names, types)
+        fields = [col for col, value in typed.items() if not same_value(value, existing.get(names.get(col, col)))]
+        if fields:
+            modified.append((doc_id, {names.get(col, col): typed[col] for col in fields}, fields, key_value))
+        else:
+            unchanged += 1
+    missing = [key_value for key_value in current if key_value not in records]
+    return new, modified, unchanged, missing
+
+# --- ÉCRITURE PAR LOTS ---
+def commit_batch(collection, writes):
+    batch = utils.db.batch()
+    col_ref = utils.db.collection(collection)
+    for doc_id, record in writes:
+        batch.set(col_ref.document(doc_id) if doc_id else col_ref.document(), record, merge=True)
+    batch.commit()
+    return len(writes)
+
+def write_changes(collection, writes, workers=4, batch_size=FIRESTORE_MAX_BATCH):
+    """Écrit [(doc_id ou None, record)] par lots de `batch_size`, `workers` lots en parallèle."""
+    chunks = [writes[i:i + batch_size] for i in range(0, len(writes), batch_size)]
+    written = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for count in executor.map(lambda chunk: commit_batch(collection, chunk), chunks):
+            written += count
+            print(f"  {written}/{len(writes)} documents écrits")
+    return written
+
+def print_report(collection, new, modified, unchanged, missing, key, limit=20):
+    print(f"\nCollection '{collection}' :")
+    print(f"  nouveaux : {len(new)}  |  modifiés : {len(modified)}  |  inchangés : {unchanged}  |  absents du fichier (conservés) : {len(missing)}")
+    for record in new[:limit]:
+        print(f"  + {record[key]}")
+    for _, _, fields, label in modified[:limit]:
+        print(f"  ~ {label} : {', '.join(fields)}")
+    if len(new) > limit or len(modified) > limit:
+        print(f"  ... (affichage limité à {limit} lignes par catégorie)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import en masse d'un tableur vers Firestore (écrit seulement les différences).")
+    parser.add_argument('collection', choices=sorted(IMPORT_TARGETS))
+    parser.add_argument('path', help="Fichier CSV ou Excel")
+    parser.add_argument('--sheet', help="Feuille Excel (première par défaut)")
+    parser.add_argument('--dry-run', action='store_true', help="Affiche le rapport de différences sans rien écrire")
+    parser.add_argument('--workers', type=int, default=4, help="Lots écrits en parallèle")
+    parser.add_argument('--batch-size', type=int, default=FIRESTORE_MAX_BATCH, help=f"Écritures par lot (max {FIRESTORE_MAX_BATCH})")
+    args = parser.parse_args(argv)
+
+    target = IMPORT_TARGETS[args.collection]
+    start = time.perf_counter()
+    records = normalize_records(read_table(args.path, args.sheet), target)
+    current = load_current_documents(args.collection, target)
+    new, modified, unchanged, missing = diff_collection(records, current, target['rename'])
+    print_report(args.collection, new, modified, unchanged, missing, target['key'])
+
+    writes = [(None, record) for record in new] + [(doc_id, values) for doc_id, values, _, _ in modified]
+    if args.dry_run or not writes:
+        print(f"\nAucune écriture ({'simulation' if args.dry_run else 'rien à mettre à jour'}) — {time.perf_counter() - start:.1f} s")
+        return 0
+
+    batch_size = min(args.batch_size, FIRESTORE_MAX_BATCH)
+    print(f"\nÉcriture de {len(writes)} documents en {math.ceil(len(writes) / batch_size)} lot(s)...")
+    write_changes(args.collection, writes, workers=args.workers, batch_size=batch_size)
+    if args.collection == 'formsquestions':
+        # Les réplicas rechargent la structure dès la prochaine vérification de version
+        print(f"Nouvelle version de la structure : {utils.bump_form_structure_version()}")
+    print(f"Terminé en {time.perf_counter() - start:.1f} s")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,523 @@
+# loadtest.py (Test de charge : N auditeurs virtuels simultanés sur le parcours complet de app.py)
+#
+# Utilisation : python loadtest.py --users 10 --phases 3 --photos 4
+#               python loadtest.py --users 10 --processes
+#
+# Chaque utilisateur virtuel pilote app.py avec l'API de test headless de Streamlit (AppTest) :
+# recherche du projet, identification, plusieurs phases avec photos téléversées (st.file_uploader),
+# fin d'audit et tous les exports.
+# Firestore est remplacé par une base en mémoire (InMemoryFirestore) installée avant l'import de utils.
+#
+# Deux modes :
+#   partagé (par défaut) : les N sessions sont ouvertes dans un seul process, comme N auditeurs sur un même
+#     réplica (caches st.cache_*, ReferenceStore et écrivain de brouillons partagés). AppTest s'appuie sur un
+#     Runtime global : les exécutions sont entrelacées et sérialisées par APPTEST_LOCK, comme des reruns limités
+#     par le GIL. La latence inclut donc l'attente de ce verrou (la file vue par l'auditeur) et le RSS rapporté
+#     est celui d'un réplica servant N sessions : c'est le chiffre de dimensionnement.
+#   --processes : un process par auditeur, chacun avec sa propre base en mémoire, démarrés ensemble derrière une
+#     barrière. Mesure le CPU consommé en parallèle ; chaque process est un réplica à une seule session.
+import argparse
+import contextlib
+import copy
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import statistics
+import sys
+import threading
+import time
+import uuid
+from io import BytesIO
+from pathlib import Path
+
+import firebase_admin
+from firebase_admin import firestore
+
+APP_DIR = Path(__file__).resolve().parent
+APP_PATH = APP_DIR / 'app.py'
+APPTEST_LOCK = threading.Lock()
+START_BARRIER_TIMEOUT = 600  # Secondes laissées aux process pour amorcer leur base avant le départ commun
+
+# --- FIRESTORE EN MÉMOIRE ---
+def unquote_field(field):
+    """'`L [Plan de Déploiement]`' -> 'L [Plan de Déploiement]' (chemins de champ Firestore échappés)."""
+    field = str(field)
+    return field[1:-1].replace('\\`', '`') if field.startswith('`') and field.endswith('`') else field
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(unquote_field(field))
+
+class FakeDocumentReference:
+    def __init__(self, db, collection_path, doc_id):
+        self._db = db
+        self._collection_path = collection_path
+        self.id = doc_id
+        self.path = '/'.join(collection_path + (doc_id,))
+
+    def collection(self, name):
+        return FakeCollectionReference(self._db, self._collection_path + (self.id, name))
+
+    def get(self, field_paths=None):
+        data = self._db._read(self._collection_path, self.id)
+        if data is not None and field_paths is not None:
+            wanted = {unquote_field(f) for f in field_paths}
+            data = {k: v for k, v in data.items() if k in wanted}
+        return FakeDocumentSnapshot(self, data)
+
+    def set(self, data, merge=False):
+        self._db._write(self._collection_path, self.id, data, merge)
+
+    def update(self, data):
+        self._db._write(self._collection_path, self.id, data, True)
+
+    def delete(self):
+        self._db._delete(self._collection_path, self.id)
+
+class FakeQuery:
+    def __init__(self, db, collection_path, filters=(), orders=(), limit=None, start_after=None, fields=None):
+        self._db = db
+        self._collection_path = collection_path
+        self._filters = filters
+        self._orders = orders
+        self._limit = limit
+        self._start_after = start_after
+        self._fields = fields
+
+    def _copy(self, **changes):
+        params = dict(filters=self._filters, orders=self._orders, limit=self._limit, start_after=self._start_after, fields=self._fields)
+        params.update(changes)
+        return FakeQuery(self._db, self._collection_path, **params)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((unquote_field(field_path), op_string, value),))
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((unquote_field(field_path), direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(start_after=document_fields_or_snapshot)
+
+    def select(self, field_paths):
+        return self._copy(fields=[unquote_field(f) for f in field_paths])
+
+    def _sort_key(self, doc_id, data):
+        key = []
+        for field, _ in self._orders:
+            value = doc_id if field == '__name__' else data.get(field)
+            key.append((value is None, value if value is not None else 0))
+        return key + [doc_id]
+
+    def _matches(self, data):
+        ops = {'==': lambda a, b: a == b, '!=': lambda a, b: a != b, '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+               '>': lambda a, b: a > b, '>=': lambda a, b: a >= b, 'in': lambda a, b: a in b}
+        return all(field in data and ops[op](data[field], value) for field, op, value in self._filters)
+
+    def stream(self, **kwargs):
+        docs = [(doc_id, data) for doc_id, data in self._db._list(self._collection_path) if self._matches(data)]
+        descending = any(direction == 'DESCENDING' for _, direction in self._orders)
+        docs.sort(key=lambda item: self._sort_key(*item), reverse=descending)
+        if self._start_after is not None:
+            after = self._start_after
+            after_key = self._sort_key(after.id, after._data or {}) if isinstance(after, FakeDocumentSnapshot) else None
+            docs = [d for d in docs if (self._sort_key(*d) < after_key if descending else self._sort_key(*d) > after_key)]
+        if self._limit is not None:
+            docs = docs[:self._limit]
+        collection = FakeCollectionReference(self._db, self._collection_path)
+        for doc_id, data in docs:
+            if self._fields is not None:
+                data = {k: v for k, v in data.items() if k in self._fields}
+            yield FakeDocumentSnapshot(collection.document(doc_id), data)
+
+    def get(self, **kwargs):
+        return list(self.stream())
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, db, collection_path):
+        super().__init__(db, collection_path)
+        self.id = collection_path[-1]
+
+    def document(self, document_id=None):
+        return FakeDocumentReference(self._db, self._collection_path, document_id or uuid.uuid4().hex[:20])
+
+    def add(self, document_data):
+        ref = self.document()
+        ref.set(document_data)
+        return None, ref
+
+class FakeWriteBatch:
+    MAX_WRITES = 500
+
+    def __init__(self, db):
+        self._db = db
+        self._ops = []
+
+    def set(self, reference, document_data, merge=False):
+        self._ops.append(lambda: reference.set(document_data, merge=merge))
+
+    def update(self, reference, field_updates):
+        self._ops.append(lambda: reference.update(field_updates))
+
+    def delete(self, reference):
+        self._ops.append(reference.delete)
+
+    def commit(self):
+        if len(self._ops) > self.MAX_WRITES:
+            raise ValueError(f"Trop d'écritures dans un lot : {len(self._ops)} > {self.MAX_WRITES}")
+        with self._db._lock:
+            for op in self._ops: op()
+        self._db.batch_commits += 1
+        self._ops = []
+
+class InMemoryFirestore:
+    """Sous-ensemble de l'API Firestore utilisé par l'application, en mémoire et protégé par un verrou."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._collections = {}
+        self.reads = 0
+        self.writes = 0
+        self.batch_commits = 0
+
+    def collection(self, name):
+        return FakeCollectionReference(self, (name,))
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def _read(self, collection_path, doc_id):
+        with self._lock:
+            self.reads += 1
+            data = self._collections.get(collection_path, {}).get(doc_id)
+            return copy.deepcopy(data)
+
+    def _list(self, collection_path):
+        with self._lock:
+            docs = list(self._collections.get(collection_path, {}).items())
+            self.reads += len(docs)
+            return [(doc_id, copy.deepcopy(data)) for doc_id, data in docs]
+
+    def _write(self, collection_path, doc_id, data, merge):
+        with self._lock:
+            self.writes += 1
+            docs = self._collections.setdefault(collection_path, {})
+            if merge and doc_id in docs:
+                docs[doc_id].update(copy.deepcopy(data))
+            else:
+                docs[doc_id] = copy.deepcopy(data)
+
+    def _delete(self, collection_path, doc_id):
+        with self._lock:
+            self.writes += 1
+            self._collections.get(collection_path, {}).pop(doc_id, None)
+
+def install_fake_firestore():
+    """Remplace l'initialisation Firebase de utils par la base en mémoire (à appeler avant d'importer utils)."""
+    fake_db = InMemoryFirestore()
+    firebase_admin._apps.setdefault('[DEFAULT]', object())
+    firestore.client = lambda *args, **kwargs: fake_db
+    return fake_db
+
+# --- JEU DE DONNÉES SYNTHÉTIQUE ---
+ID_SECTION = 'Identification'
+PHASES = ['Bornes AC', 'Bornes DC', 'Génie civil', 'Raccordement', 'Signalétique']
+
+def seed_reference_data(db, sites=2000, questions_per_phase=8):
+    """Crée des Sites et une structure de formulaire réalistes (texte, choix, nombre, photo).
+
+    Les quantités 'Plan de Déploiement' varient d'un site à l'autre : selon le site, le nombre de photos
+    envoyées correspond ou non au nombre attendu (et le commentaire d'écart est alors exigé).
+    Retourne {section: [ids des questions photo]}.
+    """
+    for i in range(sites):
+        db.collection('Sites').document(f"site{i:05d}").set({
+            'Intitulé': f"Site {i:05d} - Ville {i % 97}",
+            'Fournisseur Bornes AC [Bornes]': 'Fournisseur A', 'Fournisseur Bornes DC [Bornes]': 'Fournisseur B',
+            'L [Plan de Déploiement]': 1 + i % 4, 'R [Plan de Déploiement]': i % 3, 'UR [Plan de Déploiement]': (i + 1) % 2,
+            'Pré L [Plan de Déploiement]': 0, 'Pré R [Plan de Déploiement]': 0, 'Pré UR [Plan de Déploiement]': 0,
+            'Commentaire interne': 'x' * 200,
+        })
+    q_id = 1
+    photo_questions = {}
+    questions = db.collection('formsquestions')
+    for section in [ID_SECTION] + PHASES:
+        count = 4 if section == ID_SECTION else questions_per_phase
+        for i in range(count):
+            if q_id == 100: q_id += 1  # 100 = commentaire dynamique (COMMENT_ID)
+            q_type = ['text', 'select', 'number', 'photo'][i % 4] if section != ID_SECTION else ['text', 'select', 'text', 'number'][i]
+            questions.document(f"q{q_id:04d}").set({
+                'id': q_id, 'section': section, 'question': f"Question {q_id} ({section}) ?", 'type': q_type,
+                'obligatoire': 'Oui' if q_type != 'photo' else 'Non', 'options': 'Oui, Non, Sans objet' if q_type == 'select' else '',
+                'Description': '', 'Condition on': 0, 'Condition value': '',
+            })
+            if q_type == 'photo': photo_questions.setdefault(section, []).append(q_id)
+            q_id += 1
+    return photo_questions
+
+def synthetic_photo(index, size=(1600, 1200)):
+    """JPEG synthétique de la taille d'une photo de téléphone (réduite), au format attendu par FileUploader.set_value."""
+    from PIL import Image
+    buf = BytesIO()
+    Image.new('RGB', size, ((index * 40) % 255, 120, 200)).save(buf, format='JPEG', quality=85)
+    return (f"photo_{index}.jpg", buf.getvalue(), 'image/jpeg')
+
+# --- UTILISATEUR VIRTUEL ---
+class VirtualAuditor:
+    """Parcours complet d'un auditeur ; chaque interaction est chronométrée sous un nom d'étape."""
+
+    def __init__(self, user_index, phases, photos_per_phase, timeout, lock=None):
+        from streamlit.testing.v1 import AppTest
+        self.user_index = user_index
+        self.phases = phases
+        self.photos_per_phase = photos_per_phase
+        self.lock = lock if lock is not None else contextlib.nullcontext()
+        self.timings = []
+        self.at = AppTest.from_file(str(APP_PATH), default_timeout=timeout)
+        self.at.secrets['draft_backend'] = 'firestore'
+
+    def step(self, name, action):
+        start = time.perf_counter()
+        with self.lock:
+            action()
+        self.timings.append((name, time.perf_counter() - start))
+        if self.at.exception:
+            raise RuntimeError(f"[utilisateur {self.user_index}] étape '{name}' : {self.at.exception[0].message}")
+
+    def button(self, label):
+        return next(b for b in self.at.button if b.label == label)
+
+    def selectbox(self, label):
+        return next(s for s in self.at.selectbox if s.label == label)
+
+    def fill_visible_questions(self):
+        for widget in self.at.text_input:
+            widget.input(f"Réponse {self.user_index}")
+        for widget in self.at.text_area:
+            widget.input("Justification")
+        for widget in self.at.selectbox:
+            if widget.label == 'S': widget.select('Oui')
+        for widget in self.at.number_input:
+            widget.set_value(2)
+
+    def upload_photos(self):
+        """Photos synthétiques déposées dans chaque question photo visible (vrais UploadedFile côté application)."""
+        for widget in self.at.get('file_uploader'):
+            widget.set_value([synthetic_photo(i) for i in range(self.photos_per_phase)])
+
+    def run(self):
+        at = self.at
+        self.step('chargement', at.run)
+        self.step('recherche', lambda: at.text_input(key='project_search_input').input(f"Site {self.user_index % 2000:05d}").run())
+        project = next(o for o in self.selectbox('Résultats de la recherche').options if o)
+        self.step('selection_projet', lambda: self.selectbox('Résultats de la recherche').select(project).run())
+        self.step('demarrage', lambda: self.button("✅ Démarrer l'identification").click().run())
+
+        self.fill_visible_questions()
+        self.step('saisie_identification', at.run)
+        self.step('validation_identification', lambda: self.button("✅ Valider l'identification").click().run())
+
+        for phase_idx in range(self.phases):
+            phase_name = PHASES[phase_idx % len(PHASES)]
+            self.step('ajout_phase', lambda: self.button("➕ Ajouter une phase").click().run())
+            self.step('choix_phase', lambda: self.selectbox('Quelle phase ?').select(phase_name).run())
+            self.fill_visible_questions()
+            self.upload_photos()
+            self.step('saisie_phase', at.run)
+            self.step('validation_phase', lambda: self.button("💾 Valider la phase").click().run())
+            if at.session_state['step'] == 'FILL_PHASE':
+                # Écart entre photos attendues et reçues : le commentaire (COMMENT_ID) est exigé puis la phase revalidée
+                self.fill_visible_questions()
+                self.step('justification_ecart', at.run)
+                self.step('validation_phase', lambda: self.button("💾 Valider la phase").click().run())
+                if at.session_state['step'] == 'FILL_PHASE':
+                    raise RuntimeError(f"[utilisateur {self.user_index}] phase '{phase_name}' refusée : {at.session_state['last_validation_errors']}")
+
+        from streamlit.runtime.uploaded_file_manager import UploadedFile
+        uploaded = sum(
+            len(answer) for phase in at.session_state['collected_data'] for answer in phase['answers'].values()
+            if isinstance(answer, list) and answer and isinstance(answer[0], UploadedFile)
+        )
+        if self.photos_per_phase and not uploaded:
+            raise RuntimeError(f"[utilisateur {self.user_index}] aucune photo téléversée n'a atteint les phases validées")
+        self.step('fin_et_exports', lambda: self.button("🏁 Terminer l'audit").click().run())
+        labels = {b.label for b in at.get('download_button')}
+        missing = {'📄 CSV', '📸 ZIP Photos', '📋 Rapport Word', '🌐 Rapport HTML'} - labels
+        if missing:
+            raise RuntimeError(f"[utilisateur {self.user_index}] exports manquants : {sorted(missing)}")
+        return self.timings
+
+# --- MESURES ---
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered: return 0.0
+    k = (len(ordered) - 1) * pct / 100
+    lower, upper = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+def peak_rss_mb():
+    # ru_maxrss est en kilo-octets sous Linux, en octets sous macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+def summarize(all_timings, wall_time, cpu_time, errors, users):
+    by_step = {}
+    for name, duration in all_timings:
+        by_step.setdefault(name, []).append(duration * 1000)
+    steps = {
+        name: {
+            'n': len(values), 'p50_ms': round(percentile(values, 50), 1), 'p90_ms': round(percentile(values, 90), 1),
+            'p99_ms': round(percentile(values, 99), 1), 'max_ms': round(max(values), 1), 'mean_ms': round(statistics.mean(values), 1),
+        }
+        for name, values in by_step.items()
+    }
+    return {
+        'users': users, 'errors': errors, 'wall_time_s': round(wall_time, 2),
+        'cpu_time_s': round(cpu_time, 2), 'cpu_utilisation': round(cpu_time / wall_time, 2) if wall_time else 0.0,
+        'peak_rss_mb': round(peak_rss_mb(), 1), 'steps': steps,
+    }
+
+def print_report(report):
+    print(f"\nMode : {report.get('mode', 'shared')}  |  Utilisateurs : {report['users']}  |  erreurs : {len(report['errors'])}  |  durée : {report['wall_time_s']} s")
+    rss_label = "RSS max d'un process à une session" if report.get('mode') == 'processes' else "RSS max du réplica"
+    print(f"CPU : {report['cpu_time_s']} s ({report['cpu_utilisation']} cœur(s) en moyenne)  |  {rss_label} : {report['peak_rss_mb']} Mo\n")
+    print(f"{'étape':<28}{'n':>6}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, s in report['steps'].items():
+        print(f"{name:<28}{s['n']:>6}{s['p50_ms']:>10}{s['p90_ms']:>10}{s['p99_ms']:>10}{s['max_ms']:>10}")
+    if 'firestore' in report:
+        print(f"\nFirestore (en mémoire) : {report['firestore']['reads']} lectures, {report['firestore']['writes']} écritures")
+    for error in report['errors']:
+        print(f"ERREUR : {error}")
+
+def process_cpu_time():
+    times = os.times()
+    return times.user + times.system
+
+def run_shared(args):
+    """Mode partagé : N sessions dans ce process, sur une seule base, un seul ReferenceStore et un seul écrivain."""
+    fake_db = install_fake_firestore()
+    seed_reference_data(fake_db, sites=args.sites)
+    sys.path.insert(0, str(APP_DIR))
+    import utils  # noqa: F401  (initialise utils avec la base en mémoire)
+    reads, writes = fake_db.reads, fake_db.writes
+    results = [{'user': i, 'timings': [], 'error': None} for i in range(args.users)]
+
+    def run_user(result):
+        auditor = VirtualAuditor(result['user'], args.phases, args.photos, args.timeout, lock=APPTEST_LOCK)
+        try:
+            result['timings'] = auditor.run()
+        except Exception as e:
+            result['timings'], result['error'] = auditor.timings, str(e)
+
+    cpu_start, wall_start = process_cpu_time(), time.perf_counter()
+    threads = [threading.Thread(target=run_user, args=(result,), name=f"auditeur-{result['user']}") for result in results]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    wall_time = time.perf_counter() - wall_start
+    cpu_time = process_cpu_time() - cpu_start
+    firestore_ops = {'reads': fake_db.reads - reads, 'writes': fake_db.writes - writes}
+    return results, wall_time, cpu_time, peak_rss_mb(), firestore_ops
+
+def run_virtual_user(user_index, args, barrier, results):
+    """Process d'un auditeur : base en mémoire amorcée, départ commun, parcours puis mesures renvoyées au parent."""
+    result = {'user': user_index, 'timings': [], 'error': None}
+    try:
+        fake_db = install_fake_firestore()
+        seed_reference_data(fake_db, sites=args.sites)
+        sys.path.insert(0, str(APP_DIR))
+        import utils  # noqa: F401  (initialise utils avec la base en mémoire)
+        auditor = VirtualAuditor(user_index, args.phases, args.photos, args.timeout)
+        reads, writes = fake_db.reads, fake_db.writes
+        barrier.wait(START_BARRIER_TIMEOUT)
+        cpu_start = resource.getrusage(resource.RUSAGE_SELF)
+        try:
+            result['timings'] = auditor.run()
+        finally:
+            cpu_end = resource.getrusage(resource.RUSAGE_SELF)
+            result['cpu_time'] = (cpu_end.ru_utime - cpu_start.ru_utime) + (cpu_end.ru_stime - cpu_start.ru_stime)
+            result['timings'] = result['timings'] or auditor.timings
+            result['firestore'] = {'reads': fake_db.reads - reads, 'writes': fake_db.writes - writes}
+    except threading.BrokenBarrierError:
+        result['error'] = f"[utilisateur {user_index}] départ commun abandonné (un autre process a échoué)"
+    except Exception as e:
+        result['error'] = str(e)
+        barrier.abort()
+    result['peak_rss_mb'] = peak_rss_mb()
+    results.put(result)
+
+def run_processes(args):
+    """Mode --processes : un process par auditeur, tous démarrés ensemble."""
+    # 'spawn' : chaque process repart d'un interpréteur vierge (Runtime Streamlit et threads non hérités)
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(args.users + 1)
+    queue_ = ctx.Queue()
+    processes = [ctx.Process(target=run_virtual_user, args=(i, args, barrier, queue_)) for i in range(args.users)]
+    for process in processes: process.start()
+
+    results = []
+    try:
+        barrier.wait(START_BARRIER_TIMEOUT)
+    except threading.BrokenBarrierError:
+        pass  # L'erreur du process fautif est remontée par la file de résultats
+    wall_start = time.perf_counter()
+    deadline = wall_start + args.timeout * (4 + 2 * args.phases)
+    while len(results) < len(processes):
+        try:
+            results.append(queue_.get(timeout=max(1.0, deadline - time.perf_counter())))
+        except queue.Empty:
+            results.append({'user': None, 'timings': [], 'error': f"{len(processes) - len(results)} process sans résultat (délai dépassé)"})
+            break
+    wall_time = time.perf_counter() - wall_start
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive(): process.terminate()
+
+    cpu_time = sum(r.get('cpu_time', 0.0) for r in results)
+    # Mémoire d'un process à une seule session (la somme de N interpréteurs n'est pas un chiffre de dimensionnement)
+    rss = max((r['peak_rss_mb'] for r in results if 'peak_rss_mb' in r), default=0.0)
+    firestore_ops = {
+        'reads': sum(r.get('firestore', {}).get('reads', 0) for r in results),
+        'writes': sum(r.get('firestore', {}).get('writes', 0) for r in results),
+    }
+    return results, wall_time, cpu_time, rss, firestore_ops
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test de charge du parcours d'audit Streamlit.")
+    parser.add_argument('--users', type=int, default=5, help="Nombre d'auditeurs virtuels simultanés")
+    parser.add_argument('--phases', type=int, default=3, help="Phases remplies par auditeur")
+    parser.add_argument('--photos', type=int, default=3, help="Photos synthétiques par question photo")
+    parser.add_argument('--sites', type=int, default=2000, help="Nombre de documents Sites")
+    parser.add_argument('--timeout', type=float, default=120, help="Délai maximal d'une exécution du script (s)")
+    parser.add_argument('--processes', action='store_true', help="Un process par auditeur (CPU en parallèle) au lieu d'un réplica partagé")
+    parser.add_argument('--json', dest='json_path', help="Écrit aussi le rapport au format JSON")
+    args = parser.parse_args(argv)
+
+    results, wall_time, cpu_time, rss, firestore_ops = (run_processes if args.processes else run_shared)(args)
+    all_timings = [timing for result in results for timing in result['timings']]
+    errors = [result['error'] for result in results if result['error']]
+    report = summarize(all_timings, wall_time, cpu_time, errors, args.users)
+    report['mode'] = 'processes' if args.processes else 'shared'
+    report['peak_rss_mb'] = round(rss, 1)
+    report['firestore'] = firestore_ops
+    print_report(report)
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding='utf-8')
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+# report_template.py (Modèle Word du rapport d'audit, versionné et chargé une fois par process)
+import copy
+import logging
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+from docx import Document
+from docx.shared import Pt, RGBColor
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.enum.style import WD_STYLE_TYPE
+
+# --- CONSTANTES ---
+REPORT_TEMPLATE_VERSION = 'v1'
+TEMPLATE_DIR = Path(__file__).resolve().parent / 'audit_report_templates'  # Paquet de données livré par setup.py
+
+logger = logging.getLogger(__name__)
+
+# Libellés de la table "Informations du Projet" (colonne 0) ; la colonne 1 est remplie à chaque rapport
+PROJECT_TABLE_LABELS = ['Intitulé', 'Date de début', 'Date de fin']
+
+def template_path(version=REPORT_TEMPLATE_VERSION):
+    return TEMPLATE_DIR / f'rapport_audit_{version}.docx'
+
+def get_or_add_style(doc, name):
+    """Retourne le style de paragraphe `name`, en le créant s'il n'existe pas."""
+    if name in [s.name for s in doc.styles]:
+        return doc.styles[name]
+    return doc.styles.add_style(name, WD_STYLE_TYPE.PARAGRAPH)
+
+def define_custom_styles(doc):
+    """Définit et configure les trois styles de mise en forme."""
+    # 1. Report Title
+    title_style = get_or_add_style(doc, 'Report Title')
+    title_font = title_style.font
+    title_font.name, title_font.size, title_font.bold = 'Arial', Pt(20), True
+    title_font.color.rgb = RGBColor(0x01, 0x38, 0x2D)
+    title_style.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    title_style.paragraph_format.space_after = Pt(20)
+
+    # 2. Report Subtitle
+    subtitle_style = get_or_add_style(doc, 'Report Subtitle')
+    subtitle_font = subtitle_style.font
+    subtitle_font.name, subtitle_font.size, subtitle_font.bold = 'Arial', Pt(14), True
+    subtitle_font.color.rgb = RGBColor(0x00, 0x56, 0x47)
+    subtitle_style.paragraph_format.space_after = Pt(10)
+
+    # 3. Report Text
+    text_style = get_or_add_style(doc, 'Report Text')
+    text_font = text_style.font
+    text_font.name, text_font.size = 'Calibri', Pt(11)
+    text_style.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+
+def build_report_template():
+    """Construit le modèle : styles, en-tête et table projet (valeurs vides)."""
+    doc = Document()
+    define_custom_styles(doc)
+
+    # En-tête
+    doc.add_paragraph('Rapport d\'Audit Chantier', style='Report Title')
+
+    # Informations Projet
+    doc.add_paragraph('Informations du Projet', style='Report Subtitle')
+    project_table = doc.add_table(rows=len(PROJECT_TABLE_LABELS), cols=2)
+    project_table.style = 'Light Grid Accent 1'
+    for row, label in zip(project_table.rows, PROJECT_TABLE_LABELS):
+        row.cells[0].text = label
+        for cell in row.cells:
+            for p in cell.paragraphs: p.style = 'Report Text'
+    return doc
+
+@lru_cache(maxsize=None)
+def load_report_template(version=REPORT_TEMPLATE_VERSION):
+    """Modèle analysé une seule fois par process et par version (ne jamais le modifier directement).
+
+    Si le fichier de la version courante manque, le modèle est construit en mémoire (avec un avertissement) ;
+    une autre version sans fichier est une erreur (secret 'report_template_version' mal saisi, par exemple).
+    """
+    path = template_path(version)
+    if path.exists():
+        return Document(BytesIO(path.read_bytes()))
+    if version != REPORT_TEMPLATE_VERSION:
+        raise FileNotFoundError(f"Modèle de rapport '{version}' introuvable : {path}")
+    logger.warning("Fichier modèle %s absent : modèle %s construit en mémoire", path, version)
+    return build_report_template()
+
+def new_report_document(version=REPORT_TEMPLATE_VERSION):
+    """Copie indépendante du modèle, prête à être complétée pour un rapport."""
+    return copy.deepcopy(load_report_template(version))
+
+if __name__ == '__main__':
+    # Régénère le fichier modèle de la version courante : python report_template.py
+    TEMPLATE_DIR.mkdir(exist_ok=True)
+    build_report_template().save(template_path())
+    print(f"Modèle écrit : {template_path()}")
@@ -4,13 +4,16 @@ from setuptools import setup
 setup(
     name='my_shared_utils',
     version='0.1.0', # Utilisez une version pour la gestion
-    py_modules=['utils'],  # Nom du fichier Python à inclure
+    py_modules=['utils', 'report_template', 'drafts'],  # Nom des fichiers Python à inclure
+    packages=['audit_report_templates'],  # Modèles Word du rapport, installés à côté de report_template.py
+    package_data={'audit_report_templates': ['*.docx']},
     install_requires=[
         'streamlit',
         'pandas',
         'firebase-admin',
         'numpy',
         'python-docx', # Dépendance pour la génération de rapport Word
+        'pillow', # Miniatures du rapport HTML
     ],
     # Si d'autres métadonnées sont utiles (auteur, description, etc.)
     description='Librairie de fonctions utilitaires partagées pour Streamlit.',
@@ -4,17 +4,32 @@ import pandas as pd
 import uuid
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+from google.api_core import exceptions as gexc
 from datetime import datetime
 import numpy as np
 import zipfile
+import csv
+import gzip
 from io import BytesIO
 import io
 import urllib.parse
-from docx import Document
-from docx.shared import Inches, Pt, RGBColor
+import html
+import base64
+import hashlib
+from collections import OrderedDict
+from functools import lru_cache
+from types import MappingProxyType
+from typing import NamedTuple
+import threading
+import logging
+import time
+from docx.shared import Inches, Pt
 from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.enum.style import WD_STYLE_TYPE
 from docx.enum.table import WD_ALIGN_VERTICAL
+from PIL import Image, ImageOps
+import report_template
+import drafts
 
 # --- CONSTANTES ---
 PROJECT_RENAME_MAP = {
@@ -40,6 +55,14 @@ SECTION_PHOTO_RULES = {
     "Bornes AC": ['L [Plan de Déploiement]'],
 }
 
+# Variantes de noms de colonnes rencontrées dans 'formsquestions'
+FORM_COLUMN_RENAME_MAP = {'Conditon value': 'Condition value', 'condition value': 'Condition value', 'Condition Value': 'Condition value', 'Condition': 'Condition value', 'Conditon on': 'Condition on', 'condition on': 'Condition on'}
+
+# Sites : seul le champ de recherche est chargé pour tous les sites, le reste à la sélection du projet
+SITE_SEARCH_FIELD = 'Intitulé'
+SITE_DOC_ID_COLUMN = '_doc_id'
+SITES_PROJECTED_LOAD = True
+
 COMMENT_ID = 100
 COMMENT_QUESTION = "Veuillez préciser pourquoi le nombre de photo partagé ne correspond pas au minimum attendu"
 
@@ -70,18 +93,124 @@ def initialize_firebase():
 
 db = initialize_firebase()
 
+# --- LECTURE PAGINÉE ---
+FIRESTORE_PAGE_SIZE = 500
+FIRESTORE_READ_RETRIES = 5
+FIRESTORE_RETRY_DELAY = 0.5  # Secondes, doublé à chaque nouvelle tentative
+PENDING_LOAD_MAX_AGE = 120  # Secondes : au-delà, une lecture interrompue est recommencée depuis le début
+TRANSIENT_FIRESTORE_ERRORS = (
+    gexc.ServiceUnavailable, gexc.DeadlineExceeded, gexc.InternalServerError, gexc.Aborted, gexc.ResourceExhausted,
+)
+
+logger = logging.getLogger(__name__)
+
+class CollectionCheckpoint:
+    """État d'une lecture paginée : curseur et colonnes déjà construites, pour reprendre sans repartir de zéro."""
+
+    def __init__(self, version=None):
+        self.version = version
+        self.created_at = time.monotonic()
+        self.last_doc = None
+        self.columns = {}
+        self.rows = 0
+        self.page_timings = []
+        self.done = False
+
+    def add_record(self, record):
+        """Ajoute une ligne au format colonnaire (les colonnes absentes valent None)."""
+        for key, value in record.items():
+            column = self.columns.get(key)
+            if column is None:
+                column = self.columns[key] = [None] * self.rows
+            column.append(value)
+        self.rows += 1
+        for column in self.columns.values():
+            if len(column) < self.rows: column.append(None)
+
+    def to_frame(self):
+        return pd.DataFrame(self.columns) if self.rows else None
+
+def iter_collection_pages(query, page_size=FIRESTORE_PAGE_SIZE, checkpoint=None, label=''):
+    """Lit une requête page par page (curseur start_after) ; les erreurs transitoires sont retentées sur la même page.
+
+    Le curseur du checkpoint n'avance qu'une fois la page consommée : une reprise relit au plus une page.
+    """
+    checkpoint = checkpoint if checkpoint is not None else CollectionCheckpoint()
+    attempt = 0
+    while not checkpoint.done:
+        page_query = query.limit(page_size)
+        if checkpoint.last_doc is not None:
+            page_query = page_query.start_after(checkpoint.last_doc)
+        start = time.perf_counter()
+        try:
+            docs = page_query.get()
+        except TRANSIENT_FIRESTORE_ERRORS as e:
+            attempt += 1
+            if attempt > FIRESTORE_READ_RETRIES: raise
+            logger.warning("Lecture %s interrompue (%s), nouvelle tentative %d", label, e, attempt)
+            time.sleep(FIRESTORE_RETRY_DELAY * 2 ** (attempt - 1))
+            continue
+        attempt = 0
+        elapsed = time.perf_counter() - start
+        checkpoint.page_timings.append(elapsed)
+        logger.info("Lecture %s : page %d, %d documents en %.3f s", label, len(checkpoint.page_timings), len(docs), elapsed)
+        if docs:
+            yield docs
+            checkpoint.last_doc = docs[-1]
+        if len(docs) < page_size:
+            checkpoint.done = True
+
+# Lectures interrompues, reprises à l'appel suivant depuis leur dernier curseur
+PENDING_LOADS = {}
+PENDING_LOADS_LOCK = threading.Lock()
+
+def take_pending_load(key, version=None):
+    """Checkpoint d'une lecture interrompue, s'il est récent et de la même version ; sinon un checkpoint neuf.
+
+    Une reprise trop ancienne (ou après un changement de version) mêlerait deux états de la collection.
+    """
+    with PENDING_LOADS_LOCK:
+        checkpoint = PENDING_LOADS.pop(key, None)
+    if checkpoint is not None and checkpoint.version == version and time.monotonic() - checkpoint.created_at <= PENDING_LOAD_MAX_AGE:
+        return checkpoint
+    return CollectionCheckpoint(version)
+
+def load_collection_frame(key, query, to_record, page_size=FIRESTORE_PAGE_SIZE, version=None):
+    """Construit un DataFrame page par page, sans matérialiser toute la collection en snapshots ni en dicts."""
+    checkpoint = take_pending_load(key, version)
+    try:
+        for docs in iter_collection_pages(query, page_size, checkpoint, label=key):
+            for record in [to_record(doc) for doc in docs]:
+                checkpoint.add_record(record)
+    except Exception:
+        with PENDING_LOADS_LOCK:
+            PENDING_LOADS[key] = checkpoint
+        raise
+    return checkpoint.to_frame()
+
+def iter_form_answers(page_size=FIRESTORE_PAGE_SIZE):
+    """Parcourt les soumissions FormAnswers une page à la fois (mémoire bornée par la taille de page)."""
+    query = db.collection('FormAnswers').order_by('__name__')
+    for docs in iter_collection_pages(query, page_size, label='FormAnswers'):
+        for doc in docs:
+            yield doc.id, doc.to_dict()
+
 # --- CHARGEMENT DONNÉES ---
-@st.cache_data(ttl=3600)
-def load_form_structure_from_firestore():
+@lru_cache(maxsize=None)
+def split_options(raw):
+    """Découpe la chaîne d'options 'a, b, c' en tuple de choix nettoyés (partagé entre questions identiques)."""
+    raw = str(raw).strip()
+    return tuple(o.strip() for o in raw.split(',')) if raw else ()
+
+def load_form_structure_from_firestore(version=None):
+    """`version` : version de la structure lue (formsmeta) ; une lecture interrompue d'une autre version n'est pas reprise."""
     try:
-        docs = db.collection('formsquestions').order_by('id').get()
-        data = [doc.to_dict() for doc in docs]
-        if not data: return None
-        df = pd.DataFrame(data)
+        query = db.collection('formsquestions').order_by('id')
+        df = load_collection_frame('formsquestions', query, lambda doc: doc.to_dict(), version=version)
+        if df is None: return None
         df.columns = df.columns.str.strip()
         
-        rename_map = {'Conditon value': 'Condition value', 'condition value': 'Condition value', 'Condition Value': 'Condition value', 'Condition': 'Condition value', 'Conditon on': 'Condition on', 'condition on': 'Condition on'}
-        actual_rename = {k: v for k, v in rename_map.items() if k in df.columns}
+        actual_rename = {k: v for k, v in FORM_COLUMN_RENAME_MAP.items() if k in df.columns}
         df = df.rename(columns=actual_rename)
         
         expected_cols = ['options', 'Description', 'Condition value', 'Condition on', 'section', 'id', 'question', 'type', 'obligatoire']
@@ -93,51 +222,247 @@ def load_form_structure_from_firestore():
         df['Condition value'] = df['Condition value'].fillna('')
         df['Condition on'] = pd.to_numeric(df['Condition on'], errors='coerce').fillna(0).astype(int)
         
-        for col in df.select_dtypes(include=['object']).columns:
+        for col in df.select_dtypes(include=['object', 'string']).columns:
             df[col] = df[col].astype(str).str.strip()
+
+        # Typage compact : les consommateurs lisent directement des valeurs prêtes à l'emploi
+        df['id'] = pd.to_numeric(df['id'], errors='coerce').fillna(0).astype(int)
+        df['section'] = df['section'].astype(str).str.strip().astype('category')
+        df['type'] = df['type'].astype(str).str.strip().str.lower().astype('category')
+        df['obligatoire'] = df['obligatoire'].astype(str).str.strip().str.lower().eq('oui')
+        # Textes très répétés en catégories (une seule copie par valeur) ; les options sont découpées à l'affichage
+        for col in ['options', 'Description', 'Condition value']:
+            df[col] = df[col].astype('category')
         return df
     except Exception as e:
         st.error(f"Erreur lors du chargement de la structure du formulaire: {e}")
         return None
 
-@st.cache_data(ttl=3600)
-def load_site_data_from_firestore():
+def load_site_data_from_firestore(projected=SITES_PROJECTED_LOAD):
+    """Charge les Sites ; en mode projeté, seul le champ de recherche est téléchargé (détails via load_project_data)."""
     try:
-        docs = db.collection('Sites').get()
-        data = [doc.to_dict() for doc in docs]
-        if not data: return None
-        df_site = pd.DataFrame(data)
+        query = db.collection('Sites')
+        if projected:
+            query = query.select([FieldPath(SITE_SEARCH_FIELD).to_api_repr()])
+        query = query.order_by('__name__')
+        to_record = lambda doc: {SITE_DOC_ID_COLUMN: doc.id, **(doc.to_dict() or {})}
+        df_site = load_collection_frame('Sites:projected' if projected else 'Sites', query, to_record)
+        if df_site is None: return None
         df_site.columns = df_site.columns.str.strip()
+        if projected and SITE_SEARCH_FIELD not in df_site.columns:
+            # Nom de champ stocké différemment (espaces) : repli sur le chargement complet
+            return load_site_data_from_firestore(projected=False)
         return df_site
     except Exception as e:
         st.error(f"Erreur lors du chargement des données des sites: {e}")
         return None
 
-# --- LOGIQUE MÉTIER ---
-
-def get_expected_photo_count(section_name, project_data):
-    if section_name.strip() not in SECTION_PHOTO_RULES:
-        return None, None 
+def load_project_data(site_row):
+    """Données complètes du projet sélectionné : le document Sites entier (une lecture), enregistré tel quel avec la soumission."""
+    project_data = {k: v for k, v in dict(site_row).items() if k != SITE_DOC_ID_COLUMN}
+    doc_id = dict(site_row).get(SITE_DOC_ID_COLUMN)
+    if doc_id is None or pd.isna(doc_id):
+        return project_data
+    try:
+        details = db.collection('Sites').document(doc_id).get().to_dict() or {}
+        project_data.update({str(k).strip(): v for k, v in details.items()})
+    except Exception as e:
+        st.error(f"Erreur lors du chargement des détails du projet: {e}")
+    return project_data
+
+# --- DONNÉES DE RÉFÉRENCE PARTAGÉES ---
+REFERENCE_TTL = 3600
+FORM_VERSION_COLLECTION = 'formsmeta'
+FORM_VERSION_DOCUMENT = 'formsquestions'
+FORM_VERSION_CHECK_INTERVAL = 30  # Secondes entre deux lectures du document de version
+PINNED_SNAPSHOT_IDLE = 6 * 3600  # Une version non consultée depuis ce délai n'est plus épinglée par aucune session
+
+def read_form_structure_version():
+    """Version de 'formsquestions' (document formsmeta/formsquestions, champ 'version') ; None si le document n'existe pas."""
+    doc = db.collection(FORM_VERSION_COLLECTION).document(FORM_VERSION_DOCUMENT).get()
+    return (doc.to_dict() or {}).get('version') if doc.exists else None
+
+def bump_form_structure_version():
+    """À appeler après toute modification de 'formsquestions' : chaque réplica rechargera la structure une seule fois."""
+    version = uuid.uuid4().hex
+    db.collection(FORM_VERSION_COLLECTION).document(FORM_VERSION_DOCUMENT).set({'version': version, 'updated_at': datetime.now()})
+    return version
+
+def build_question_index(df_struct):
+    """Index {id: (question, section, type)} construit une fois par version de la structure."""
+    return MappingProxyType({
+        q_id: (question, section, q_type)
+        for q_id, question, section, q_type in zip(df_struct['id'], df_struct['question'], df_struct['section'], df_struct['type'])
+    })
+
+class ReferenceSnapshot(NamedTuple):
+    version: int
+    df_struct: pd.DataFrame
+    df_site: pd.DataFrame
+    form_version: object
+    question_index: MappingProxyType
+    sections: tuple
+    struct_loaded_at: datetime
+    sites_loaded_at: datetime
+
+class ReferenceStore:
+    """Structure du formulaire et données Sites, chargées une fois par process et partagées par toutes les sessions.
+
+    Les DataFrames publiés sont en lecture seule : ne jamais les modifier en place.
+    Les sessions ne conservent que le numéro de version ; un rafraîchissement publie un nouvel
+    instantané par échange atomique de référence, et la structure des versions encore consultées reste
+    lisible. Seule la structure est épinglée : les Sites sont toujours ceux de l'instantané courant,
+    une seule copie par process.
+
+    La structure est rechargée dès que le document de version change (vérifié au plus toutes les
+    FORM_VERSION_CHECK_INTERVAL secondes), et dans tous les cas après REFERENCE_TTL comme les Sites :
+    une modification faite dans la console Firebase sans changer la version finit donc par être vue.
+    """
+
+    def __init__(self, ttl=REFERENCE_TTL, check_interval=FORM_VERSION_CHECK_INTERVAL, pinned_idle=PINNED_SNAPSHOT_IDLE):
+        self._ttl = ttl
+        self._check_interval = check_interval
+        self._pinned_idle = pinned_idle
+        self._lock = threading.Lock()
+        self._snapshots = {}
+        self._last_access = {}
+        self._last_version_check = 0.0
+        self._current = None
+
+    def _is_fresh(self, loaded_at):
+        return (datetime.now() - loaded_at).total_seconds() < self._ttl
+
+    def _version_check_due(self):
+        return time.monotonic() - self._last_version_check >= self._check_interval
+
+    def current(self, force_refresh=False):
+        """Instantané courant ; ne recharge que la partie modifiée (structure) ou expirée (Sites)."""
+        snapshot = self._current
+        if not force_refresh and snapshot is not None and self._is_fresh(snapshot.sites_loaded_at) and not self._version_check_due():
+            return snapshot
+        with self._lock:
+            snapshot = self._current
+            reload_struct = reload_sites = force_refresh or snapshot is None
+            form_version = snapshot.form_version if snapshot is not None else None
+            if reload_struct or self._version_check_due():
+                self._last_version_check = time.monotonic()
+                try:
+                    form_version = read_form_structure_version()
+                except Exception as e:
+                    logger.warning("Version de la structure illisible : %s", e)
+                if not reload_struct:
+                    reload_struct = form_version != snapshot.form_version or not self._is_fresh(snapshot.struct_loaded_at)
+            if not reload_sites:
+                reload_sites = not self._is_fresh(snapshot.sites_loaded_at)
+            if not (reload_struct or reload_sites):
+                return snapshot
+
+            now = datetime.now()
+            if reload_struct:
+                df_struct = load_form_structure_from_firestore(form_version)
+                if df_struct is None: return snapshot  # Échec : on conserve l'instantané précédent s'il existe
+                struct_parts = dict(
+                    df_struct=df_struct, form_version=form_version, question_index=build_question_index(df_struct),
+                    sections=tuple(df_struct['section'].unique().tolist()), struct_loaded_at=now,
+                )
+            else:
+                struct_parts = dict(
+                    df_struct=snapshot.df_struct, form_version=snapshot.form_version, question_index=snapshot.question_index,
+                    sections=snapshot.sections, struct_loaded_at=snapshot.struct_loaded_at,
+                )
+            if reload_sites:
+                df_site = load_site_data_from_firestore()
+                if df_site is None: return snapshot
+                sites_loaded_at = now
+            else:
+                df_site, sites_loaded_at = snapshot.df_site, snapshot.sites_loaded_at
+            version = snapshot.version + 1 if snapshot is not None else 1
+            return self._publish(ReferenceSnapshot(version=version, df_site=df_site, sites_loaded_at=sites_loaded_at, **struct_parts))
+
+    def _publish(self, snapshot):
+        now = time.monotonic()
+        previous = self._current
+        if previous is not None and previous.version in self._snapshots:
+            # L'ancienne version ne garde que sa structure ; ses Sites sont libérés
+            self._snapshots[previous.version] = previous._replace(df_site=None)
+        self._snapshots[snapshot.version] = snapshot
+        self._last_access[snapshot.version] = now
+        self._current = snapshot
+        # Les versions que plus aucune session ne consulte sont libérées
+        for version, last_access in list(self._last_access.items()):
+            if version != snapshot.version and now - last_access > self._pinned_idle:
+                self._snapshots.pop(version, None)
+                self._last_access.pop(version, None)
+        return snapshot
+
+    def get(self, version):
+        """Instantané épinglé par une session (structure de sa version, Sites courants) ; repli sur l'instantané courant si la version a été libérée."""
+        snapshot = self._snapshots.get(version)
+        if snapshot is None:
+            return self.current()
+        self._last_access[version] = time.monotonic()
+        current = self._current
+        if snapshot.df_site is None:
+            return snapshot._replace(df_site=current.df_site, sites_loaded_at=current.sites_loaded_at)
+        return snapshot
+
+@st.cache_resource
+def get_reference_store():
+    return ReferenceStore()
 
-    columns = SECTION_PHOTO_RULES[section_name.strip()]
-    total_expected = 0
-    details = []
+@st.cache_data(ttl=3600)
+def load_photo_rules_from_firestore():
+    """Règles photo : SECTION_PHOTO_RULES, complété ou surchargé par la collection 'photorules'.
 
-    for col in columns:
-        val = project_data.get(col, 0)
-        try:
-            if pd.isna(val) or val == "":
-                num = 0
+    Chaque document porte 'section' et 'columns' (liste de colonnes Sites) ; une liste vide désactive la règle.
+    """
+    rules = {section: list(columns) for section, columns in SECTION_PHOTO_RULES.items()}
+    try:
+        for doc in db.collection('photorules').get():
+            data = doc.to_dict() or {}
+            section = str(data.get('section', '')).strip()
+            columns = data.get('columns')
+            if not section or not isinstance(columns, list): continue
+            if columns:
+                rules[section] = [str(c).strip() for c in columns]
             else:
-                num = int(float(str(val).replace(',', '.'))) 
-        except Exception:
-            num = 0
-        total_expected += num
-        short_name = PROJECT_RENAME_MAP.get(col, col) 
-        details.append(f"{num} {short_name}")
+                rules.pop(section, None)
+    except Exception as e:
+        st.warning(f"Règles photo Firestore indisponibles, règles par défaut utilisées : {e}")
+    return rules
 
-    detail_str = " + ".join(details)
-    return total_expected, detail_str
+# --- LOGIQUE MÉTIER ---
+
+def parse_plan_count(val):
+    """Convertit une valeur 'Plan de Déploiement' (ex. '2,0', 3.0, '') en entier, 0 par défaut."""
+    try:
+        if pd.isna(val) or val == "":
+            return 0
+        return int(float(str(val).replace(',', '.')))
+    except Exception:
+        return 0
+
+def build_photo_profile(project_data, rules=None):
+    """Calcule une seule fois, à la sélection du projet, le nombre de photos attendu par section.
+
+    Retourne un mapping immuable {section: (total_attendu, détail)}.
+    """
+    if rules is None:
+        rules = load_photo_rules_from_firestore()
+    profile = {}
+    for section, columns in rules.items():
+        total_expected = 0
+        details = []
+        for col in columns:
+            num = parse_plan_count(project_data.get(col, 0))
+            total_expected += num
+            short_name = PROJECT_RENAME_MAP.get(col, col)
+            details.append(f"{num} {short_name}")
+        profile[section.strip()] = (total_expected, " + ".join(details))
+    return MappingProxyType(profile)
+
+def get_expected_photo_count(section_name, photo_profile):
+    return photo_profile.get(section_name.strip(), (None, None))
 
 def evaluate_single_condition(condition_str, all_answers):
     if "=" not in condition_str:
@@ -179,18 +504,18 @@ def check_condition(row, current_answers, collected_data):
             return True
     return False
 
-def validate_section(df_questions, section_name, answers, collected_data, project_data):
+def validate_section(df_questions, section_name, answers, collected_data, photo_profile):
     missing = []
     section_rows = df_questions[df_questions['section'] == section_name]
     comment_val = answers.get(COMMENT_ID)
     has_justification = comment_val is not None and str(comment_val).strip() != ""
     
-    expected_total_base, detail_str = get_expected_photo_count(section_name.strip(), project_data)
+    expected_total_base, detail_str = get_expected_photo_count(section_name, photo_profile)
     expected_total = expected_total_base
     
     photo_question_count = sum(
         1 for _, row in section_rows.iterrows()
-        if str(row.get('type', '')).strip().lower() == 'photo' and check_condition(row, answers, collected_data)
+        if row['type'] == 'photo' and check_condition(row, answers, collected_data)
     )
     
     if expected_total is not None and expected_total > 0:
@@ -201,20 +526,19 @@ def validate_section(df_questions, section_name, answers, collected_data, projec
     photo_questions_found = False
     
     for _, row in section_rows.iterrows():
-        q_type = str(row['type']).strip().lower()
-        if q_type == 'photo' and check_condition(row, answers, collected_data):
+        if row['type'] == 'photo' and check_condition(row, answers, collected_data):
             photo_questions_found = True
-            q_id = int(row['id'])
+            q_id = row['id']
             val = answers.get(q_id)
             if isinstance(val, list):
                 current_photo_count += len(val)
 
     for _, row in section_rows.iterrows():
-        q_id = int(row['id'])
+        q_id = row['id']
         if q_id == COMMENT_ID: continue
         if not check_condition(row, answers, collected_data): continue
-        is_mandatory = str(row['obligatoire']).strip().lower() == 'oui'
-        q_type = str(row['type']).strip().lower()
+        is_mandatory = row['obligatoire']
+        q_type = row['type']
         val = answers.get(q_id)
         if is_mandatory:
             if q_type == 'photo':
@@ -248,57 +572,23 @@ def validate_section(df_questions, section_name, answers, collected_data, projec
 
 # --- SAUVEGARDE ET EXPORTS ---
 
-def define_custom_styles(doc):
-    """Définit et configure les trois styles de mise en forme."""
-    # 1. Report Title
-    try: title_style = doc.styles.add_style('Report Title', WD_STYLE_TYPE.PARAGRAPH)
-    except: title_style = doc.styles['Report Title']
-    title_font = title_style.font
-    title_font.name, title_font.size, title_font.bold = 'Arial', Pt(20), True
-    title_font.color.rgb = RGBColor(0x01, 0x38, 0x2D)
-    title_style.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    title_style.paragraph_format.space_after = Pt(20)
-
-    # 2. Report Subtitle
-    try: subtitle_style = doc.styles.add_style('Report Subtitle', WD_STYLE_TYPE.PARAGRAPH)
-    except: subtitle_style = doc.styles['Report Subtitle']
-    subtitle_font = subtitle_style.font
-    subtitle_font.name, subtitle_font.size, subtitle_font.bold = 'Arial', Pt(14), True
-    subtitle_font.color.rgb = RGBColor(0x00, 0x56, 0x47)
-    subtitle_style.paragraph_format.space_after = Pt(10)
-
-    # 3. Report Text
-    try: text_style = doc.styles.add_style('Report Text', WD_STYLE_TYPE.PARAGRAPH)
-    except: text_style = doc.styles['Report Text']
-    text_font = text_style.font
-    text_font.name, text_font.size = 'Calibri', Pt(11)
-    text_style.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-
-def create_word_report(collected_data, df_struct, project_data, form_start_time):
+def set_paragraph_style_id(paragraph, style_id):
+    """Applique un style par son identifiant, sans la recherche par nom (coûteuse) de python-docx."""
+    paragraph._p.get_or_add_pPr().style = style_id
+
+def create_word_report(collected_data, df_struct, project_data, form_start_time, question_index=None, template_version=report_template.REPORT_TEMPLATE_VERSION):
     """Génère le rapport Word complet avec styles et photos."""
-    doc = Document()
-    define_custom_styles(doc)
-    
-    # En-tête
-    doc.add_paragraph('Rapport d\'Audit Chantier', style='Report Title')
+    # Styles, en-tête et table projet proviennent du modèle versionné
+    doc = report_template.new_report_document(template_version)
 
     # Informations Projet
-    doc.add_paragraph('Informations du Projet', style='Report Subtitle')
-    project_table = doc.add_table(rows=3, cols=2)
-    project_table.style = 'Light Grid Accent 1'
-    
-    project_table.rows[0].cells[0].text = 'Intitulé'
-    project_table.rows[0].cells[1].text = str(project_data.get('Intitulé', 'N/A'))
-    
+    project_table = doc.tables[0]
     start_time_str = form_start_time.strftime('%d/%m/%Y %H:%M') if form_start_time else "N/A"
-    project_table.rows[1].cells[0].text = 'Date de début'
-    project_table.rows[1].cells[1].text = start_time_str
-    project_table.rows[2].cells[0].text = 'Date de fin'
-    project_table.rows[2].cells[1].text = datetime.now().strftime('%d/%m/%Y %H:%M')
-
-    for row in project_table.rows:
-        for cell in row.cells:
-            for p in cell.paragraphs: p.style = 'Report Text'
+    project_values = [str(project_data.get('Intitulé', 'N/A')), start_time_str, datetime.now().strftime('%d/%m/%Y %H:%M')]
+    for row, value in zip(project_table.rows, project_values):
+        cell = row.cells[1]
+        cell.text = value
+        cell.paragraphs[0].style = 'Report Text'
     
     doc.add_paragraph()
     doc.add_paragraph('Détails du Projet', style='Report Subtitle')
@@ -313,45 +603,51 @@ def create_word_report(collected_data, df_struct, project_data, form_start_time)
     doc.add_page_break()
     
     # Phases et Questions
+    question_index = question_index if question_index is not None else build_question_index(df_struct)
+    text_style_id = doc.styles['Report Text'].style_id
     for phase_idx, phase in enumerate(collected_data):
         doc.add_paragraph(f'Phase: {phase["phase_name"]}', style='Report Subtitle')
         
+        # Répartition en un seul passage, dans l'ordre des questions
+        text_answers, photo_answers = [], []
         for q_id, answer in phase['answers'].items():
             # Texte question
             if int(q_id) == COMMENT_ID:
                 q_text = COMMENT_QUESTION
             else:
-                q_row = df_struct[df_struct['id'].astype(int) == int(q_id)]
-                q_text = q_row.iloc[0]['question'] if not q_row.empty else f"ID {q_id}"
-            
-            # Traitement Photos
+                q_text = question_index[int(q_id)][0] if int(q_id) in question_index else f"ID {q_id}"
             is_photo = (isinstance(answer, list) and answer and hasattr(answer[0], 'read')) or hasattr(answer, 'read')
-            
-            if is_photo:
-                doc.add_paragraph(f'Q{q_id}: {q_text}', style='Report Subtitle')
-                photos = answer if isinstance(answer, list) else [answer]
-                for idx, f_obj in enumerate(photos):
-                    try:
-                        f_obj.seek(0)
-                        doc.add_picture(BytesIO(f_obj.read()), width=Inches(5))
-                        cap = doc.add_paragraph(f'Photo {idx+1}: {f_obj.name}', style='Report Text')
-                        cap.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                        if cap.runs: 
-                            cap.runs[0].font.size, cap.runs[0].font.italic = Pt(9), True
-                        f_obj.seek(0)
-                    except: doc.add_paragraph(f"[Erreur Photo {idx+1}]", style='Report Text')
-                doc.add_paragraph()
-            else:
-                # Texte / Sélection
-                t = doc.add_table(rows=1, cols=2)
-                t.style = 'Light Grid Accent 1'
-                t.cell(0,0).text = f'Q{q_id}: {q_text}'
-                t.cell(0,1).text = str(answer)
-                for cell in t.rows[0].cells:
-                    cell.paragraphs[0].style = 'Report Text'
-                    cell.vertical_alignment = WD_ALIGN_VERTICAL.CENTER
-                t.cell(0,0).paragraphs[0].runs[0].bold = True
-                doc.add_paragraph()
+            (photo_answers if is_photo else text_answers).append((q_id, q_text, answer))
+        
+        # Texte / Sélection : une seule table multi-lignes par phase
+        if text_answers:
+            t = doc.add_table(rows=len(text_answers), cols=2)
+            t.style = 'Light Grid Accent 1'
+            for row, (q_id, q_text, answer) in zip(t.rows, text_answers):
+                q_cell, a_cell = row.cells
+                q_par, a_par = q_cell.paragraphs[0], a_cell.paragraphs[0]
+                set_paragraph_style_id(q_par, text_style_id)
+                set_paragraph_style_id(a_par, text_style_id)
+                q_par.add_run(f'Q{q_id}: {q_text}').bold = True
+                a_par.add_run(str(answer))
+                q_cell.vertical_alignment = a_cell.vertical_alignment = WD_ALIGN_VERTICAL.CENTER
+            doc.add_paragraph()
+        
+        # Traitement Photos (regroupées après la table)
+        for q_id, q_text, answer in photo_answers:
+            doc.add_paragraph(f'Q{q_id}: {q_text}', style='Report Subtitle')
+            photos = answer if isinstance(answer, list) else [answer]
+            for idx, f_obj in enumerate(photos):
+                try:
+                    f_obj.seek(0)
+                    doc.add_picture(BytesIO(f_obj.read()), width=Inches(5))
+                    cap = doc.add_paragraph(f'Photo {idx+1}: {f_obj.name}', style='Report Text')
+                    cap.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                    if cap.runs: 
+                        cap.runs[0].font.size, cap.runs[0].font.italic = Pt(9), True
+                    f_obj.seek(0)
+                except: doc.add_paragraph(f"[Erreur Photo {idx+1}]", style='Report Text')
+            doc.add_paragraph()
         
         if phase_idx < len(collected_data) - 1: doc.add_page_break()
     
@@ -391,16 +687,66 @@ def save_form_data(collected_data, project_data, submission_id, start_time):
     except Exception as e:
         return False, str(e)
 
-def create_csv_export(collected_data, df_struct, project_name, submission_id, start_time):
-    data_for_df = []
-    for phase in collected_data:
-        for q_id, answer in phase['answers'].items():
-            if not hasattr(answer, 'read') and not (isinstance(answer, list) and answer and hasattr(answer[0], 'read')):
-                data_for_df.append({
-                    'Projet': project_name, 'Phase': phase['phase_name'],
-                    'Question_ID': q_id, 'Réponse': answer
-                })
-    return pd.DataFrame(data_for_df).to_csv(index=False).encode('utf-8')
+CSV_COLUMNS = ['Soumission_ID', 'Projet', 'Phase', 'Section', 'Question_ID', 'Question', 'Type', 'Réponse']
+
+class CsvExportWriter:
+    """Écrit l'export CSV ligne par ligne vers un flux d'octets : UTF-8 avec BOM (lisible par Excel), gzip optionnel."""
+
+    def __init__(self, sink, df_struct, compress=False, question_index=None):
+        self._gzip = gzip.GzipFile(fileobj=sink, mode='wb') if compress else None
+        self._text = io.TextIOWrapper(self._gzip or sink, encoding='utf-8-sig', newline='')
+        self._writer = csv.writer(self._text)
+        self._questions = question_index if question_index is not None else build_question_index(df_struct)
+        self._writer.writerow(CSV_COLUMNS)
+
+    def write_submission(self, submission_id, project_name, collected_data):
+        """Une ligne par réponse non-photo, dans l'ordre des phases et des questions."""
+        for phase in collected_data:
+            for q_id, answer in phase['answers'].items():
+                if hasattr(answer, 'read') or (isinstance(answer, list) and answer and hasattr(answer[0], 'read')):
+                    continue
+                if int(q_id) == COMMENT_ID:
+                    question, section, q_type = COMMENT_QUESTION, phase['phase_name'], 'text'
+                else:
+                    question, section, q_type = self._questions.get(int(q_id), ('', '', ''))
+                # FormAnswers enregistre les photos en texte ("Fichiers: a.jpg, ...") : exclues comme en session
+                if q_type == 'photo': continue
+                self._writer.writerow([
+                    submission_id, project_name, phase['phase_name'], section, q_id, question, q_type,
+                    '' if answer is None else answer,
+                ])
+
+    def close(self):
+        """Vide les tampons sans fermer le flux de destination."""
+        self._text.flush()
+        self._text.detach()
+        if self._gzip is not None:
+            self._gzip.close()
+
+def create_csv_export(collected_data, df_struct, project_name, submission_id, start_time, compress=False, question_index=None):
+    buf = BytesIO()
+    writer = CsvExportWriter(buf, df_struct, compress=compress, question_index=question_index)
+    writer.write_submission(submission_id, project_name, collected_data)
+    writer.close()
+    return buf.getvalue()
+
+def export_submissions_csv(sink, df_struct, compress=False, page_size=FIRESTORE_PAGE_SIZE, question_index=None):
+    """Exporte toutes les soumissions FormAnswers vers `sink`, à mémoire constante (lecture paginée). Retourne le nombre exporté."""
+    writer = CsvExportWriter(sink, df_struct, compress=compress, question_index=question_index)
+    count = 0
+    for doc_id, submission in iter_form_answers(page_size):
+        phases = [
+            {'phase_name': phase.get('phase_name', ''), 'answers': phase.get('answers', {})}
+            for phase in submission.get('collected_phases', [])
+        ]
+        writer.write_submission(submission.get('submission_id', doc_id), submission.get('project_intitule', ''), phases)
+        count += 1
+    writer.close()
+    return count
+
+def zip_photo_name(phase_name, q_id, index):
+    """Nom d'une photo dans l'archive ZIP (également utilisé comme lien par le rapport HTML)."""
+    return f"{phase_name}_Q{q_id}_{index}.jpg"
 
 def create_zip_export(collected_data):
     buf = io.BytesIO()
@@ -410,12 +756,163 @@ def create_zip_export(collected_data):
                 photos = files if isinstance(files, list) else [files]
                 for i, f in enumerate(photos):
                     if hasattr(f, 'getvalue'):
-                        zip_file.writestr(f"{phase['phase_name']}_Q{q_id}_{i}.jpg", f.getvalue())
+                        zip_file.writestr(zip_photo_name(phase['phase_name'], q_id, i), f.getvalue())
+    buf.seek(0)
+    return buf
+
+# --- RAPPORT HTML ---
+HTML_THUMBNAIL_SIZE = (320, 320)
+
+HTML_REPORT_CSS = """
+body { font-family: Calibri, Arial, sans-serif; margin: 0 auto; max-width: 900px; padding: 12px; color: #222; }
+h1 { color: #01382D; text-align: center; font-size: 1.6em; }
+h2 { color: #005647; font-size: 1.2em; border-bottom: 2px solid #E9630C; padding-bottom: 4px; margin-top: 28px; }
+table { border-collapse: collapse; width: 100%; margin: 8px 0; }
+th, td { border: 1px solid #ccc; padding: 6px 8px; text-align: left; vertical-align: top; font-size: 0.95em; }
+th { background: #f2f7f6; width: 45%; }
+.gallery { display: flex; flex-wrap: wrap; gap: 8px; }
+figure { margin: 0; width: 150px; }
+figure img { width: 150px; height: auto; border-radius: 4px; }
+figcaption { font-size: 0.75em; color: #555; word-break: break-all; }
+.note { font-size: 0.8em; color: #777; }
+"""
+
+HTML_THUMBNAIL_CACHE_SIZE = 1000  # Miniatures gardées par process (~15 Ko chacune)
+_thumbnail_cache = OrderedDict()
+_thumbnail_cache_lock = threading.Lock()
+
+def thumbnail_cache_key(f_obj, size):
+    """Identifiant stable d'une photo : file_id du téléversement (ou du brouillon), sinon empreinte du contenu."""
+    file_id = getattr(f_obj, 'file_id', None)
+    if file_id is None:
+        file_id = hashlib.sha256(f_obj.getvalue()).hexdigest()
+    return (file_id, size)
+
+def make_thumbnail_data_uri(f_obj, size=HTML_THUMBNAIL_SIZE):
+    """Miniature JPEG compacte, encodée en data URI pour un fichier HTML autonome.
+
+    Calculée une seule fois par photo : chaque clic sur un bouton de téléchargement relance l'étape de fin.
+    """
+    key = thumbnail_cache_key(f_obj, size)
+    with _thumbnail_cache_lock:
+        if key in _thumbnail_cache:
+            _thumbnail_cache.move_to_end(key)
+            return _thumbnail_cache[key]
+    f_obj.seek(0)
+    with Image.open(f_obj) as img:
+        # JPEG : décodage directement à une échelle réduite (1/2 à 1/8), bien plus rapide qu'un décodage complet
+        img.draft('RGB', (max(size) * 2, max(size) * 2))
+        thumb = ImageOps.exif_transpose(img).convert('RGB')
+        thumb.thumbnail(size)
+        out = BytesIO()
+        thumb.save(out, format='JPEG', quality=70, optimize=True)
+    f_obj.seek(0)
+    uri = "data:image/jpeg;base64," + base64.b64encode(out.getvalue()).decode('ascii')
+    with _thumbnail_cache_lock:
+        _thumbnail_cache[key] = uri
+        while len(_thumbnail_cache) > HTML_THUMBNAIL_CACHE_SIZE:
+            _thumbnail_cache.popitem(last=False)
+    return uri
+
+def iter_html_report(collected_data, df_struct, project_data, form_start_time, zip_file_name=None, question_index=None):
+    """Produit le rapport HTML morceau par morceau (aucun document complet en mémoire)."""
+    esc = html.escape
+    start_time_str = form_start_time.strftime('%d/%m/%Y %H:%M') if form_start_time else "N/A"
+    yield (
+        '<!DOCTYPE html><html lang="fr"><head><meta charset="utf-8">'
+        '<meta name="viewport" content="width=device-width, initial-scale=1">'
+        f"<title>Rapport d'Audit - {esc(str(project_data.get('Intitulé', 'N/A')))}</title>"
+        f'<style>{HTML_REPORT_CSS}</style></head><body>'
+        "<h1>Rapport d'Audit Chantier</h1>"
+    )
+
+    # Informations Projet
+    yield '<h2>Informations du Projet</h2><table>'
+    yield f"<tr><th>Intitulé</th><td>{esc(str(project_data.get('Intitulé', 'N/A')))}</td></tr>"
+    yield f"<tr><th>Date de début</th><td>{start_time_str}</td></tr>"
+    yield f"<tr><th>Date de fin</th><td>{datetime.now().strftime('%d/%m/%Y %H:%M')}</td></tr>"
+    for group in DISPLAY_GROUPS:
+        for field_key in group:
+            renamed_key = PROJECT_RENAME_MAP.get(field_key, field_key)
+            yield f"<tr><th>{esc(renamed_key)}</th><td>{esc(str(project_data.get(field_key, 'N/A')))}</td></tr>"
+    yield '</table>'
+    # Les outils de décompression créent un dossier au nom de l'archive : les liens pointent dans ce dossier
+    photo_dir = f"{zip_file_name.rsplit('.', 1)[0]}/" if zip_file_name else ''
+    if zip_file_name:
+        yield (f'<p class="note">Photos en taille réelle : extraire {esc(zip_file_name)} à côté de ce fichier, '
+               f'dans le dossier {esc(photo_dir)}</p>')
+
+    # Phases et Questions
+    question_index = question_index if question_index is not None else build_question_index(df_struct)
+    for phase in collected_data:
+        yield f"<h2>Phase : {esc(str(phase['phase_name']))}</h2>"
+        photo_answers = []
+        rows_open = False
+        for q_id, answer in phase['answers'].items():
+            if int(q_id) == COMMENT_ID:
+                q_text = COMMENT_QUESTION
+            else:
+                q_text = question_index[int(q_id)][0] if int(q_id) in question_index else f"ID {q_id}"
+            is_photo = (isinstance(answer, list) and answer and hasattr(answer[0], 'read')) or hasattr(answer, 'read')
+            if is_photo:
+                photo_answers.append((q_id, q_text, answer))
+                continue
+            if not rows_open:
+                yield '<table>'
+                rows_open = True
+            yield f"<tr><th>Q{q_id} : {esc(str(q_text))}</th><td>{esc(str(answer))}</td></tr>"
+        if rows_open:
+            yield '</table>'
+
+        # Galerie photos
+        for q_id, q_text, answer in photo_answers:
+            yield f'<p><strong>Q{q_id} : {esc(str(q_text))}</strong></p><div class="gallery">'
+            photos = answer if isinstance(answer, list) else [answer]
+            for idx, f_obj in enumerate(photos):
+                link = urllib.parse.quote(photo_dir + zip_photo_name(phase['phase_name'], q_id, idx))
+                caption = esc(f"Photo {idx+1}: {getattr(f_obj, 'name', '')}")
+                try:
+                    src = make_thumbnail_data_uri(f_obj)
+                    yield f'<figure><a href="{link}"><img src="{src}" alt="{caption}" loading="lazy"></a><figcaption>{caption}</figcaption></figure>'
+                except Exception:
+                    yield f'<figure><figcaption>[Erreur Photo {idx+1}]</figcaption></figure>'
+            yield '</div>'
+    yield '</body></html>'
+
+def create_html_report(collected_data, df_struct, project_data, form_start_time, zip_file_name=None, question_index=None):
+    """Rapport HTML autonome et léger (miniatures intégrées), adapté à la consultation sur mobile."""
+    buf = BytesIO()
+    for chunk in iter_html_report(collected_data, df_struct, project_data, form_start_time, zip_file_name, question_index):
+        buf.write(chunk.encode('utf-8'))
     buf.seek(0)
     return buf
 
+# --- BROUILLONS (REPRISE DE SESSION) ---
+@st.cache_resource
+def get_draft_writer():
+    """Stockage des brouillons : Firestore par défaut (survit aux redéploiements, partagé entre réplicas).
+
+    Le secret 'draft_backend' = 'local' écrit sur le disque de l'application (développement uniquement).
+    """
+    if st.secrets.get('draft_backend', 'firestore') == 'local':
+        return drafts.DraftWriter(drafts.LocalDraftStore())
+    return drafts.DraftWriter(drafts.FirestoreDraftStore(db))
+
+@st.cache_data(ttl=30)
+def list_open_drafts():
+    try:
+        return get_draft_writer().store.list_drafts()
+    except Exception as e:
+        st.warning(f"Brouillons indisponibles : {e}")
+        return []
+
+def checkpoint_draft(draft, checkpoint):
+    """Envoie un point de sauvegarde (événements, photos, métadonnées) sans bloquer l'interface."""
+    if draft is not None:
+        get_draft_writer().submit(draft.submission_id, checkpoint)
+
 # --- COMPOSANT UI ---
-def render_question(row, answers, phase_name, key_suffix, loop_index, project_data):
+def render_question(row, answers, phase_name, key_suffix, loop_index, photo_profile):
     q_id = int(row.get('id', 0))
     is_dynamic_comment = (q_id == COMMENT_ID)
     
@@ -424,9 +921,9 @@ def render_question(row, answers, phase_name, key_suffix, loop_index, project_da
         q_options = []
     else:
         q_text = row['question']
-        q_type, q_desc = str(row['type']).strip().lower(), row['Description']
-        q_mandatory = str(row['obligatoire']).lower() == 'oui'
-        q_options = str(row['options']).split(',') if row['options'] else []
+        q_type, q_desc = row['type'], row['Description']
+        q_mandatory = bool(row['obligatoire'])
+        q_options = list(split_options(row['options']))
 
     label_html = f"<strong>{q_id}. {q_text}</strong>" + (' <span class="mandatory">*</span>' if q_mandatory else "")
     widget_key = f"q_{q_id}_{phase_name}_{key_suffix}_{loop_index}"
@@ -438,13 +935,20 @@ def render_question(row, answers, phase_name, key_suffix, loop_index, project_da
     if q_type == 'text':
         answers[q_id] = st.text_area("R", value=current_val if current_val else "", key=widget_key, label_visibility="collapsed") if is_dynamic_comment else st.text_input("R", value=current_val if current_val else "", key=widget_key, label_visibility="collapsed")
     elif q_type == 'select':
-        opts = [o.strip() for o in q_options]
+        opts = q_options
         if "" not in opts: opts.insert(0, "")
         answers[q_id] = st.selectbox("S", opts, index=opts.index(current_val) if current_val in opts else 0, key=widget_key, label_visibility="collapsed")
     elif q_type == 'number':
         answers[q_id] = st.number_input("N", value=int(current_val) if current_val else 0, step=1, key=widget_key, label_visibility="collapsed")
     elif q_type == 'photo':
-        exp, det = get_expected_photo_count(phase_name.strip(), project_data)
+        exp, det = get_expected_photo_count(phase_name, photo_profile)
         if exp: st.info(f"📸 **Attendu : {exp}** ({det})")
-        answers[q_id] = st.file_uploader("I", type=['png', 'jpg', 'jpeg'], accept_multiple_files=True, key=widget_key, label_visibility="collapsed")
+        uploaded = st.file_uploader("I", type=['png', 'jpg', 'jpeg'], accept_multiple_files=True, key=widget_key, label_visibility="collapsed")
+        restored = [f for f in current_val if isinstance(f, drafts.UploadedPhoto)] if isinstance(current_val, list) else []
+        if not uploaded and restored:
+            # Photos reprises d'un brouillon : conservées tant qu'aucun nouveau fichier n'est déposé
+            st.caption(f"📎 {len(restored)} photo(s) reprise(s) du brouillon")
+            answers[q_id] = restored
+        else:
+            answers[q_id] = uploaded
     st.markdown('</div>', unsafe_allow_html=True)